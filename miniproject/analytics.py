@@ -0,0 +1,358 @@
+"""Columnar export of loan applications for training and offline analysis.
+
+`flask export-applications` streams loan_application out of the live database in
+keyset-paginated chunks and appends them to an export directory as a new part:
+Parquet (default when pyarrow is installed), Arrow IPC or, without pyarrow, one
+compressed NPZ file per chunk. Only the scalar columns are exported; document
+hashes, Aadhaar numbers and the scoring queue bookkeeping stay in the database.
+
+Each run only reads rows whose (updated_at, id) is past the watermark recorded by
+the previous run, so repeated exports are incremental. A row updated after it was
+exported shows up again in a later part; load_export() and iter_export() keep its
+latest version.
+Deleted applications are not tracked, so run a full export now and then to drop
+them. manifest.json is written last, so an interrupted run leaves the export as it
+was before it started.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet/Arrow are optional; NPZ export always works
+    pa = pq = None
+
+from models import db, LoanApplication
+
+FORMAT_NAME = 'loan_applications'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+FORMATS = ('parquet', 'arrow', 'npz')
+DEFAULT_CHUNK_SIZE = 50000
+
+# (column, numpy dtype) in export order
+SCHEMA = (
+    ('id', 'int64'),
+    ('user_id', 'int64'),
+    ('income', 'float64'),
+    ('credit_score', 'int64'),
+    ('loan_amount', 'float64'),
+    ('employment_status', 'str'),
+    ('prediction', 'str'),
+    ('rejection_reason', 'str'),
+    ('flag', 'bool'),
+    ('created_at', 'datetime64[us]'),
+    ('updated_at', 'datetime64[us]'),
+)
+EXPORT_COLUMNS = tuple(getattr(LoanApplication, name) for name, _ in SCHEMA)
+
+
+class ExportError(Exception):
+    """Raised when an export directory is unreadable, of the wrong format, or a format is unavailable."""
+
+
+def resolve_format(name):
+    """'auto' -> parquet when pyarrow is installed, npz otherwise."""
+    if name == 'auto':
+        return 'parquet' if pa is not None else 'npz'
+    if name not in FORMATS:
+        raise ExportError(f"Unknown export format {name}, expected auto or one of {', '.join(FORMATS)}")
+    if name != 'npz' and pa is None:
+        raise ExportError(f"The {name} format needs pyarrow; install it or use npz")
+    return name
+
+
+#----------------------------------------------------------------READING THE DATABASE----------------------------------------------------------------
+def export_chunk(after=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The next chunk_size rows past the (updated_at, id) watermark after, up to until.
+
+    Walks ix_loan_application_updated_at_id, so each chunk is an index range scan.
+    """
+    query = db.session.query(*EXPORT_COLUMNS)
+    if until is not None:
+        query = query.filter(LoanApplication.updated_at <= until)
+    if after is not None:
+        updated_at, last_id = after
+        query = query.filter(db.or_(
+            LoanApplication.updated_at > updated_at,
+            db.and_(LoanApplication.updated_at == updated_at, LoanApplication.id > last_id),
+        ))
+    return query.order_by(LoanApplication.updated_at, LoanApplication.id).limit(chunk_size)
+
+
+def iter_chunks(after=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield {column: list} chunks in watermark order, never holding more than one chunk."""
+    while True:
+        rows = export_chunk(after, until, chunk_size).all()
+        if not rows:
+            return
+        yield {name: list(values) for (name, _), values in zip(SCHEMA, zip(*rows))}
+        after = (rows[-1].updated_at, rows[-1].id)
+
+
+def to_numpy(chunk):
+    """Column lists -> numpy arrays; NULL text becomes '' and a NULL amount NaN."""
+    arrays = {}
+    for name, dtype in SCHEMA:
+        values = chunk[name]
+        if dtype == 'str':
+            values = ['' if v is None else v for v in values]
+        elif dtype == 'bool':
+            values = [bool(v) for v in values]
+        elif dtype == 'float64':
+            values = [np.nan if v is None else v for v in values]
+        arrays[name] = np.array(values, dtype=dtype)
+    return arrays
+
+
+def arrow_schema():
+    types = {'int64': pa.int64(), 'float64': pa.float64(), 'str': pa.string(), 'bool': pa.bool_(),
+             'datetime64[us]': pa.timestamp('us')}
+    return pa.schema([(name, types[dtype]) for name, dtype in SCHEMA])
+
+
+def to_arrow(chunk, schema):
+    return pa.record_batch([pa.array(chunk[name], type=schema.field(name).type) for name, _ in SCHEMA], schema=schema)
+
+
+#----------------------------------------------------------------WRITING----------------------------------------------------------------
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ExportError(f"Cannot read export manifest in {path}: {e}")
+    if manifest.get('format') != FORMAT_NAME or manifest.get('format_version') != FORMAT_VERSION:
+        raise ExportError(
+            f"Unsupported export {manifest.get('format')} v{manifest.get('format_version')}, "
+            f"expected {FORMAT_NAME} v{FORMAT_VERSION}; rerun with a full export"
+        )
+    return manifest
+
+
+def write_manifest(path, manifest):
+    tmp_path = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def _write_part(path, part, file_format, chunks, log):
+    """Write chunks as part number part. Returns (file names, rows, last (updated_at, id))."""
+    files, rows, last = [], 0, None
+    writer = None
+    try:
+        for number, chunk in enumerate(chunks, 1):
+            if file_format == 'npz':
+                name = f'part-{part:05d}-{number:05d}.npz'
+                tmp_path = os.path.join(path, name + '.tmp')
+                with open(tmp_path, 'wb') as f:
+                    np.savez_compressed(f, **to_numpy(chunk))
+                os.replace(tmp_path, os.path.join(path, name))
+                files.append(name)
+            else:
+                if writer is None:
+                    schema = arrow_schema()
+                    name = f'part-{part:05d}.{file_format}'
+                    files.append(name)
+                    tmp_path = os.path.join(path, name + '.tmp')
+                    if file_format == 'parquet':
+                        writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+                    else:
+                        writer = pa.ipc.new_file(tmp_path, schema)
+                # One Parquet row group / Arrow record batch per chunk
+                writer.write_batch(to_arrow(chunk, schema))
+            rows += len(chunk['id'])
+            last = (chunk['updated_at'][-1], chunk['id'][-1])
+            log(f"{path}: part {part}, {rows} rows exported")
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(os.path.join(path, files[0] + '.tmp'), os.path.join(path, files[0]))
+    return files, rows, last
+
+
+def export_applications(path, file_format='auto', chunk_size=DEFAULT_CHUNK_SIZE, full=False, lag=5, log=print):
+    """Append the applications changed since the last export to path as a new part.
+
+    lag (seconds) leaves out rows updated in the last few moments, so a transaction
+    that has stamped updated_at but not committed yet is not skipped past by the
+    watermark. With full, the export is started over. Returns the manifest.
+    """
+    file_format = resolve_format(file_format)
+    os.makedirs(path, exist_ok=True)
+    manifest = None if full else read_manifest(path)
+    if manifest is None:
+        manifest = {
+            'format': FORMAT_NAME,
+            'format_version': FORMAT_VERSION,
+            'columns': [list(column) for column in SCHEMA],
+            'parts': [],
+            'watermark': None,
+        }
+
+    watermark = manifest['watermark']
+    after = (datetime.fromisoformat(watermark['updated_at']), watermark['id']) if watermark else None
+    until = datetime.utcnow() - timedelta(seconds=lag)
+    part = len(manifest['parts']) + 1
+
+    files, rows, last = _write_part(path, part, file_format, iter_chunks(after, until, chunk_size), log)
+    if rows:
+        manifest['parts'].append({
+            'format': file_format,
+            'files': files,
+            'rows': rows,
+            'exported_at': datetime.utcnow().isoformat(),
+        })
+        manifest['watermark'] = {'updated_at': last[0].isoformat(), 'id': last[1]}
+    write_manifest(path, manifest)
+
+    if full:
+        # Files of the previous export that the new manifest no longer lists
+        listed = {name for p in manifest['parts'] for name in p['files']}
+        for name in os.listdir(path):
+            if name.startswith('part-') and name not in listed:
+                os.unlink(os.path.join(path, name))
+    return manifest
+
+
+#----------------------------------------------------------------LOADING----------------------------------------------------------------
+def _load_file(path, file_format, columns):
+    if file_format == 'npz':
+        with np.load(path) as data:
+            return {name: data[name] for name in columns}
+    if pa is None:
+        raise ExportError(f"{path} is {file_format}; loading it needs pyarrow")
+    if file_format == 'parquet':
+        table = pq.read_table(path, columns=list(columns), memory_map=True)
+    else:
+        # Memory-mapped: the columns are read straight from the page cache without a copy
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all().select(list(columns))
+    return _table_to_numpy(table, columns)
+
+
+def _table_to_numpy(table, columns):
+    arrays = {}
+    for name in columns:
+        column = table.column(name)
+        if pa.types.is_string(column.type):
+            arrays[name] = np.array(column.fill_null('').to_pylist(), dtype=str)
+        else:
+            arrays[name] = column.to_numpy()
+    return arrays
+
+
+def _export_columns(path, columns):
+    """(manifest, requested columns with id first) for the export in path."""
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ExportError(f"No export found in {path}")
+    names = [name for name, _ in manifest['columns']]
+    columns = ['id'] + [name for name in (columns or names) if name != 'id']
+    missing = set(columns) - set(names)
+    if missing:
+        raise ExportError(f"Unknown export columns: {', '.join(sorted(missing))}")
+    return manifest, columns
+
+
+def load_export(path, columns=None):
+    """Load an export as {column: numpy array}, one row per application (its latest export).
+
+    columns defaults to every exported column; id is always included. Everything is held
+    in memory; use iter_export() to go through a large export piece by piece.
+    """
+    manifest, columns = _export_columns(path, columns)
+
+    pieces = [
+        _load_file(os.path.join(path, name), part['format'], columns)
+        for part in manifest['parts'] for name in part['files']
+    ]
+    if not pieces:
+        dtypes = dict(manifest['columns'])
+        return {name: np.empty(0, dtype=dtypes[name]) for name in columns}
+    arrays = {name: np.concatenate([piece[name] for piece in pieces]) for name in columns}
+
+    # Later parts hold later versions of a row: keep the last occurrence of each id
+    ids = arrays['id']
+    _, first_from_end = np.unique(ids[::-1], return_index=True)
+    keep = np.sort(len(ids) - 1 - first_from_end)
+    if len(keep) == len(ids):
+        return arrays
+    return {name: values[keep] for name, values in arrays.items()}
+
+
+def _units(path, manifest):
+    """(file, format, index) of every NPZ file, Parquet row group and Arrow record batch, in export order."""
+    units = []
+    for part in manifest['parts']:
+        for name in part['files']:
+            file_path = os.path.join(path, name)
+            if part['format'] == 'npz':
+                units.append((file_path, 'npz', 0))
+                continue
+            if pa is None:
+                raise ExportError(f"{file_path} is {part['format']}; loading it needs pyarrow")
+            if part['format'] == 'parquet':
+                count = pq.ParquetFile(file_path, memory_map=True).num_row_groups
+            else:
+                count = pa.ipc.open_file(pa.memory_map(file_path)).num_record_batches
+            units.extend((file_path, part['format'], index) for index in range(count))
+    return units
+
+
+def _read_unit(unit, columns):
+    file_path, file_format, index = unit
+    if file_format == 'npz':
+        return _load_file(file_path, file_format, columns)
+    if file_format == 'parquet':
+        table = pq.ParquetFile(file_path, memory_map=True).read_row_group(index, columns=list(columns))
+    else:
+        batch = pa.ipc.open_file(pa.memory_map(file_path)).get_batch(index)
+        table = pa.Table.from_batches([batch]).select(list(columns))
+    return _table_to_numpy(table, columns)
+
+
+def latest_rows(path):
+    """(units, keep masks): which rows of each piece of the export hold an application's latest version.
+
+    Only the id column is read, so this costs about 9 bytes per exported row rather
+    than the whole export.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ExportError(f"No export found in {path}")
+    units = _units(path, manifest)
+    ids = [_read_unit(unit, ['id'])['id'] for unit in units]
+    if not ids:
+        return units, []
+    offsets = np.cumsum([0] + [len(unit_ids) for unit_ids in ids])
+    all_ids = np.concatenate(ids)
+    del ids
+    # Later pieces hold later versions of a row: keep the last occurrence of each id
+    _, first_from_end = np.unique(all_ids[::-1], return_index=True)
+    keep = np.zeros(len(all_ids), dtype=bool)
+    keep[len(all_ids) - 1 - first_from_end] = True
+    return units, [keep[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def iter_export(path, columns=None, latest=None):
+    """Yield {column: numpy array} one NPZ file, Parquet row group or Arrow record batch at a time.
+
+    Only the latest version of each application is yielded, as by load_export(). latest
+    is a latest_rows(path) result to reuse across passes over the same export.
+    """
+    _, columns = _export_columns(path, columns)
+    units, keep = latest if latest is not None else latest_rows(path)
+    for unit, mask in zip(units, keep):
+        if not mask.any():
+            continue
+        data = _read_unit(unit, columns)
+        yield data if mask.all() else {name: values[mask] for name, values in data.items()}
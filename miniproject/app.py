@@ -1,13 +1,40 @@
 from models import *
 from flask import Flask, render_template, request, flash, session, redirect, url_for
-from flask import send_file
+from flask import send_file, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
 import pandas as pd
 import numpy as np
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
-import pickle
-import os , io
+import os
+import click
+import csv
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import update
 from werkzeug.utils import secure_filename
+from ourmodel import FEATURES, MODEL_PATH, ARTIFACT_PATH, active_model, save_model, export_artifact
+from registry import active_models, RegistryError
+from shadow import ShadowScorer, pick_models, shadow_report
+from blobstore import BlobStore
+from docverify import document_matches
+from uploads import UploadError, receive_upload, format_size
+from migrations import upgrade_schema, migrate_blobs
+from kycimport import (import_verified_users, read_checkpoint, errors_path, store_manifest, find_manifest,
+                       import_running, MANIFEST_EXTENSIONS, KycImportError)
+from dbconfig import configure_database, install_sqlite_pragmas, check_database, database_report
+from queries import LOANS_PAGE_SIZE, LOAN_SORTS, loan_listing, encode_cursor, user_applications, applicant, explain_queries, is_full_scan
+from cache import TTLCache
+from analytics import export_applications, ExportError, FORMATS as EXPORT_FORMATS, DEFAULT_CHUNK_SIZE as EXPORT_CHUNK_SIZE
+import training
+from stats import record_new, record_change, rebuild_stats, portfolio_summary
+from identity import load_user_record, get_user_record, record_for, remember_login
+from applog import log, setup_logging
+from metrics import setup_metrics, inference_timer, count_blob_bytes
+from rules import encode_employment_status, evaluate, explain, decide, OTHER_BANK_REASON
+from scoring import run_worker, queue_length
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'gif'}  # Define allowed file extensions
 
@@ -20,24 +47,192 @@ def allowed_file(filename):
 
 
 #----------------------------------------------MODEL----------------------------------------------------
-model = pickle.load(open('loan_model.pkl', 'rb'))
-
-def predict_loan(income, credit_score, loan_amount, employment_status):
-    return "Approved" if model.predict([[income, credit_score, loan_amount, employment_status]])[0] == 1 else "Rejected"
+# 'flat' walks the flattened tree arrays directly (same decisions, far less per-call overhead),
+# 'sklearn' goes through RandomForestClassifier.predict
+INFERENCE_ENGINE = os.environ.get('LOAN_INFERENCE_ENGINE', 'flat')
+
+# Loads the current model version (see registry.py) and starts following CURRENT for new ones.
+# With the flat engine this memory-maps the artifact and refuses to start if it is stale or mismatched
+active_model()
+
+def get_engine(engine=None, model=None):
+    # model is a registry ModelVersion; callers that record which version decided pass the one they hold
+    model = model or active_model()
+    engine = engine or INFERENCE_ENGINE
+    if engine == 'flat':
+        return model.flat()
+    if engine == 'sklearn':
+        return model.sklearn()
+    raise ValueError(f"Unknown inference engine: {engine}")
+
+def predict_loan(income, credit_score, loan_amount, employment_status, engine=None, model=None, shadow=None):
+    """Approved/Rejected for one application.
+
+    With shadow (see shadow.pick_models) the same features are also scored by shadow.model
+    on the shadow pool once the decision is made; only handing them over is paid for here.
+    """
+    estimator = get_engine(engine, model)
+    X = np.array([[income, credit_score, loan_amount, employment_status]], dtype=np.float64)
+    with inference_timer(engine or INFERENCE_ENGINE, 'single'):
+        started = time.perf_counter()
+        approved = estimator.predict(X)[0] == 1
+        elapsed = time.perf_counter() - started
+    prediction = "Approved" if approved else "Rejected"
+    if shadow is not None:
+        shadow_scorer.compare(shadow, X, model or active_model(), [prediction], elapsed)
+    return prediction
+
+def predict_loans(rows, engine=None, model=None, shadow=None):
+    """Score many applications with a single predict_proba call.
+
+    rows is an (n, 4) array-like in FEATURES order. Returns (decisions, probabilities)
+    where probabilities is the approval probability of each row. shadow works as for predict_loan.
+    """
+    X = np.asarray(rows, dtype=np.float64).reshape(-1, len(FEATURES))
+    if X.shape[0] == 0:
+        return [], np.empty(0)
+
+    estimator = get_engine(engine, model)
+    with inference_timer(engine or INFERENCE_ENGINE, 'batch', rows=X.shape[0]):
+        started = time.perf_counter()
+        proba = estimator.predict_proba(X)
+        elapsed = time.perf_counter() - started
+    # Same tie-break as model.predict: the first class wins on equal probability
+    approved = estimator.classes_[np.argmax(proba, axis=1)] == 1
+    approved_proba = proba[:, list(estimator.classes_).index(1)]
+    decisions = np.where(approved, "Approved", "Rejected").tolist()
+    if shadow is not None:
+        shadow_scorer.compare(shadow, X, model or active_model(), decisions, elapsed)
+    return decisions, approved_proba
 
 
 #+----------------------------------------------------------------APP----------------------------------------
 app = Flask(__name__, template_folder='scripts')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite3'
+configure_database(app)  # LOAN_DATABASE_URL and pool/PRAGMA settings, see dbconfig.py
 app.config['SECRET_KEY'] = 'thisissecretkey'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'  # Directory to save uploaded files
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'png', 'jpg', 'jpeg'}
+app.config['BLOB_STORE'] = os.environ.get('LOAN_BLOB_STORE', os.path.join(app.instance_path, 'blobs'))  # KYC documents
+# 'exact' matches documents by SHA-256; 'perceptual' also accepts re-encoded scans of the same image
+app.config['DOCUMENT_MATCH_MODE'] = os.environ.get('LOAN_DOCUMENT_MATCH_MODE', 'exact')
+app.config['DOCUMENT_PHASH_MAX_DISTANCE'] = int(os.environ.get('LOAN_DOCUMENT_PHASH_MAX_DISTANCE', 6))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('LOAN_MAX_REQUEST_SIZE', 32 * 1024 * 1024))  # Whole request
+app.config['MAX_UPLOAD_FILE_SIZE'] = int(os.environ.get('LOAN_MAX_UPLOAD_FILE_SIZE', 10 * 1024 * 1024))  # Each document
+# Let a fronting nginx/Apache stream documents (X-Sendfile) instead of the worker
+app.config['USE_X_SENDFILE'] = os.environ.get('LOAN_USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('LOAN_DASHBOARD_CACHE_TTL', 30))  # Seconds
+# Bulk KYC imports: uploaded manifests are kept here, and their documents directory must be under the root
+app.config['KYC_IMPORT_DIR'] = os.environ.get('LOAN_KYC_IMPORT_DIR', os.path.join(app.instance_path, 'kyc_imports'))
+app.config['KYC_IMPORT_ROOT'] = os.environ.get('LOAN_KYC_IMPORT_ROOT', os.path.join(app.instance_path, 'kyc_documents'))
+# Uploaded import manifests, instead of LOAN_MAX_REQUEST_SIZE (hundreds of thousands of records)
+app.config['KYC_IMPORT_MAX_SIZE'] = int(os.environ.get('LOAN_KYC_IMPORT_MAX_SIZE', 1024 * 1024 * 1024))
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('LOAN_IDENTITY_CACHE_TTL', 60))  # Seconds
+# Queue applications as Pending for `flask score-worker` instead of scoring them on the request thread
+app.config['ASYNC_SCORING'] = os.environ.get('LOAN_ASYNC_SCORING', '').lower() in ('1', 'true', 'yes')
+# Where `flask export-applications` writes the columnar loan application history (see analytics.py)
+app.config['ANALYTICS_EXPORT_DIR'] = os.environ.get(
+    'LOAN_ANALYTICS_EXPORT_DIR', os.path.join(app.instance_path, 'analytics', 'loan_applications')
+)
 db.init_app(app)
+setup_logging(app)
+setup_metrics(app, db)
+
+blob_store = BlobStore(app.config['BLOB_STORE'])
+# user id -> that user's dashboard rows; invalidated on every write to their applications
+dashboard_cache = TTLCache(maxsize=10000, ttl=app.config['DASHBOARD_CACHE_TTL'])
+# user id -> UserRecord for the logged-in user; invalidated by delete/deactivate/activate_user
+identity_cache = TTLCache(maxsize=10000, ttl=app.config['IDENTITY_CACHE_TTL'])
+# Scores the candidate model version alongside the deciding one, off the request path (see shadow.py)
+shadow_scorer = ShadowScorer(app, engine=INFERENCE_ENGINE)
+
+def receive_documents():
+    """Stream each DOCUMENT_FIELDS upload of the request into a spooled temp file, hashing it.
+
+    Returns {field: Upload or None}; raises UploadError for a disallowed type or an
+    oversized file. The temp files are closed when the request ends.
+    """
+    uploads = {}
+    for field in DOCUMENT_FIELDS:
+        upload = receive_upload(
+            request.files.get(field), allowed_file, app.config['MAX_UPLOAD_FILE_SIZE'], tmp_dir=blob_store.tmp_dir
+        )
+        if upload:
+            g.setdefault('uploads', []).append(upload)
+        uploads[field] = upload
+    return uploads
+
+def store_upload(upload):
+    """Copy a received Upload into the blob store in chunks. Returns (sha256, size)."""
+    digest, size = blob_store.put_stream(upload.file)
+    count_blob_bytes('write', size)
+    return digest, size
+
+def document_columns(documents):
+    """Map {field: (sha256, size)} onto the <field>_sha256 / <field>_size model columns."""
+    columns = {}
+    for field, (digest, size) in documents.items():
+        columns[f'{field}_sha256'] = digest
+        columns[f'{field}_size'] = size
+    return columns
+
+# Reachable without a session, so a logged-out user is not redirected away from them
+PUBLIC_ENDPOINTS = {'home', 'login', 'logout', 'register', 'static', 'metrics'}
+
+@app.before_request
+def load_current_user():
+    """Resolve the session's user into g.user; log out accounts that were deleted or deactivated."""
+    g.user = None
+    if 'user_email' not in session:
+        return
+
+    if 'user_id' in session:
+        record = get_user_record(session['user_id'], identity_cache)
+    else:
+        # Session from before the id was stored in it
+        record = load_user_record(email=session['user_email'])
+        if record is not None:
+            identity_cache.set(record.id, record)
+            session['user_id'] = record.id
+
+    if record is None or not record.active:
+        session.clear()
+        if request.endpoint in PUBLIC_ENDPOINTS:
+            return
+        flash("Your account is not active. Please contact the bank.", "danger")
+        return redirect(url_for('login'))
+
+    # The record, not what the cookie said at login, decides the role
+    if session.get('role') != record.role:
+        session['role'] = record.role
+    g.user = record
+
+@app.teardown_request
+def close_uploads(exc):
+    for upload in g.pop('uploads', []):
+        upload.close()
+
+# Form pages that accept uploads; every other endpoint is a JSON API
+UPLOAD_FORM_ENDPOINTS = ('apply_loan', 'manage_verified_users')
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    message = f"Upload too large! Requests are limited to {format_size(request.max_content_length)}."
+    if request.endpoint not in UPLOAD_FORM_ENDPOINTS:
+        return jsonify(error=message), 413
+    # Back to the form (both also serve GET) with the message flashed
+    flash(message, "danger")
+    return redirect(url_for(request.endpoint))
 
 with app.app_context():
+    install_sqlite_pragmas(db.engine)
     db.create_all()
+    upgrade_schema()
+    check_database(db.engine, log)
+    # First start after portfolio_stat was added: build it from the applications already stored
+    if not db.session.query(PortfolioStat.id).first() and db.session.query(LoanApplication.id).first():
+        log.info("portfolio statistics rebuilt", extra={'rows': rebuild_stats()})
 
     admin_role = Role.query.filter_by(name='admin').first()
     if not admin_role:
@@ -90,8 +285,14 @@ def login():
         flash('Incorrect password', 'danger')
         return render_template('login.html')
 
-    session['user_email'] = user.email
-    session['role'] = user.role.name if user.role else "customer" 
+    if user.flag:
+        flash('Your account has been deactivated', 'danger')
+        return render_template('login.html')
+
+    # id, role and active flag go into the signed session; later requests resolve them from identity_cache
+    record = record_for(user)
+    identity_cache.set(record.id, record)
+    remember_login(session, record)
     flash("Login successful!", "success")
     if session['role'] == 'admin':
         return redirect(url_for('admin_dashboard')) 
@@ -158,7 +359,7 @@ def admin_dashboard():
     if 'role' not in session or session['role'] != 'admin':
         flash("Access Denied!", "danger")
         return redirect(url_for('user_dashboard')) 
-    return render_template('admin_dashboard.html')
+    return render_template('admin_dashboard.html', stats=portfolio_summary())
 
 #-----------------------------------------------------------------NO USE ROUTER----------------------------------------------------------------
 def process_transactions(transactions):
@@ -192,40 +393,31 @@ def user_dashboard():
         flash('Please log in first!', 'danger')
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(email=session['user_email']).first()
-    loan_application = LoanApplication.query.filter_by(user_id=user.id).order_by(LoanApplication.created_at.desc()).first()
-    loan_applications = LoanApplication.query.filter_by(user_id=user.id).order_by(LoanApplication.created_at.desc()).all()
+    user = g.user
 
-    print(f"✅ User Dashboard - User: {user.email}, User ID: {user.id}")  # Debug
+    # Whole history in one query (newest first), cached until the user applies again or an admin decides
+    loan_applications = dashboard_cache.get(user.id)
+    if loan_applications is None:
+        loan_applications = user_applications(user.id).all()
+        # The scoring worker runs in another process and cannot invalidate this cache
+        if not any(a.scoring_queued_at for a in loan_applications):
+            dashboard_cache.set(user.id, loan_applications)
+    loan_application = loan_applications[0] if loan_applications else None
 
     rejection_reason = None  
 
     if loan_application:
-        print(f"📌 Loan Found - Amount: {loan_application.loan_amount}, Status: {loan_application.prediction}")
-
         if loan_application.prediction == "Rejected":
-            if loan_application.credit_score <= 500:
-                rejection_reason = f"❌ REJECTED: Credit score ({loan_application.credit_score}) ≤ 500"
-            elif loan_application.employment_status not in ["Employed", "Self-Employed"]:
-                rejection_reason = "❌ REJECTED: Unemployed applicants do not qualify"
-            elif loan_application.loan_amount > (loan_application.income * 0.8333): 
-                suggested_loan_amount = round(loan_application.income * 0.8333, 2)
-                rejection_reason = (
-                    f"❌ REJECTED: Income (₹{loan_application.income}) too low for ₹{loan_application.loan_amount} loan. "
-                    f"💡 Suggestion: Apply for ₹{suggested_loan_amount} or less"
-                )
-
-            print(f"🚨 Loan Rejection Reason: {rejection_reason}")
-
-        elif loan_application.prediction == "Approved":
-            print("🎉 Loan Approved!")
-
-        else:
+            # Worked out and stored when the decision was made
+            rejection_reason = loan_application.rejection_reason
+        elif loan_application.prediction != "Approved":
             rejection_reason = "⏳ Loan application is under review."
-            print("⏳ Loan Pending Review")
 
-    else:
-        print("⚠️ No Loan Application Found")
+    log.debug("dashboard", extra={
+        'user_id': user.id,
+        'applications': len(loan_applications),
+        'latest_status': loan_application.prediction if loan_application else None,
+    })
 
     return render_template(
         'user_dashboard.html',
@@ -262,13 +454,19 @@ def manage_verified_users():
         aadhaar_number = request.form.get('aadhaar_number', '0')  # Default to '0' if not provided
         aadhaar_number = int(aadhaar_number) if aadhaar_number.isdigit() else 0
 
-        aadhaar_file = request.files.get('aadhaar_file')
-        pan_file = request.files.get('pan_file')
-        income_certificate_file = request.files.get('income_certificate_file')
-
-        aadhaar_binary = aadhaar_file.read() if aadhaar_file else None
-        pan_binary = pan_file.read() if pan_file else None
-        income_certificate_binary = income_certificate_file.read() if income_certificate_file else None
+        try:
+            uploads = receive_documents()
+        except UploadError as e:
+            flash(str(e), "danger")
+            return redirect(url_for('manage_verified_users'))
+
+        # Only documents that were actually uploaded replace the stored ones. Their digests are
+        # kept on the row so apply_loan can verify uploads without reading the stored files.
+        uploaded = {}
+        for field, upload in uploads.items():
+            if upload:
+                uploaded.update(document_columns({field: store_upload(upload)}))
+                uploaded[f'{field}_phash'] = upload.phash()
 
         verified_user = VerifiedUser.query.filter_by(email=email).first()
 
@@ -278,22 +476,16 @@ def manage_verified_users():
             verified_user.employment_status = employment_status
             verified_user.aadhaar_number = aadhaar_number
             
-            if aadhaar_binary:
-                verified_user.aadhaar_file = aadhaar_binary
-            if pan_binary:
-                verified_user.pan_file = pan_binary
-            if income_certificate_binary:
-                verified_user.income_certificate_file = income_certificate_binary
+            for column, value in uploaded.items():
+                setattr(verified_user, column, value)
         else:
             new_verified = VerifiedUser(
                 email=email,
                 correct_income=income,
                 correct_credit_score=credit_score,
                 employment_status=employment_status,
-                aadhaar_file=aadhaar_binary,
                 aadhaar_number=aadhaar_number,
-                pan_file=pan_binary,
-                income_certificate_file=income_certificate_binary
+                **uploaded
             )
             db.session.add(new_verified)
 
@@ -305,6 +497,103 @@ def manage_verified_users():
     return render_template('manage_verified_users.html', verified_users=verified_users)
 
 
+def run_kyc_import(manifest, documents_dir, **options):
+    """Run import_verified_users with the app's blob store and upload limits."""
+    return import_verified_users(
+        manifest, documents_dir, blob_store, allowed_file,
+        max_size=app.config['MAX_UPLOAD_FILE_SIZE'],
+        **options
+    )
+
+@app.route('/import_verified_users', methods=['POST'])
+def import_verified_users_upload():
+    """Start a background import of an uploaded CSV/JSONL manifest. Returns the job id to poll.
+
+    The job id is the manifest's SHA-256: uploading the same file again (say after the worker
+    running it was restarted) resumes the import from its checkpoint, and any worker can report
+    its status from the files on disk.
+    """
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify(error="Access Denied!"), 403
+
+    request.max_content_length = app.config['KYC_IMPORT_MAX_SIZE']
+    manifest = request.files.get('manifest')
+    extension = manifest.filename.rsplit('.', 1)[-1].lower() if manifest and '.' in manifest.filename else ''
+    if extension not in MANIFEST_EXTENSIONS:
+        return jsonify(error="Upload a .csv or .jsonl manifest as 'manifest'"), 400
+
+    root = os.path.realpath(app.config['KYC_IMPORT_ROOT'])
+    documents_dir = os.path.realpath(os.path.join(root, request.form.get('documents_dir', '')))
+    if os.path.commonpath([root, documents_dir]) != root or not os.path.isdir(documents_dir):
+        return jsonify(error="documents_dir must be an existing directory under the KYC import root"), 400
+
+    job, path = store_manifest(manifest.stream, app.config['KYC_IMPORT_DIR'], extension)
+
+    def work():
+        with app.app_context():
+            try:
+                run_kyc_import(path, documents_dir, log=lambda message: log.info(message, extra={'kyc_import': job}))
+            except KycImportError as e:
+                log.info(str(e), extra={'kyc_import': job})
+            except Exception:
+                log.exception("kyc import failed", extra={'kyc_import': job})
+
+    if not import_running(path):
+        threading.Thread(target=work, name=f'kyc-import-{job[:8]}', daemon=True).start()
+    return jsonify(job=job, status_url=url_for('import_verified_users_status', job=job)), 202
+
+@app.route('/import_verified_users/<job>')
+def import_verified_users_status(job):
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify(error="Access Denied!"), 403
+    path = find_manifest(app.config['KYC_IMPORT_DIR'], job)
+    if path is None:
+        return jsonify(error="Unknown import"), 404
+
+    state = read_checkpoint(path) or {'row': 0, 'imported': 0, 'failed': 0, 'done': False}
+    errors = []
+    if state['failed'] and os.path.exists(errors_path(path)):
+        with open(errors_path(path), newline='', encoding='utf-8') as f:
+            errors = [{'row': int(row), 'email': email, 'error': error} for row, email, error in csv.reader(f)][:100]
+    return jsonify(job=job, running=import_running(path), errors=errors, **state)
+
+@app.route('/models')
+def list_models():
+    """Published model versions, and the one this worker is serving."""
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify(error="Access Denied!"), 403
+    models = active_models()
+    candidate = models.candidate()
+    return jsonify(serving=active_model().version, current=models.registry.current_version(),
+                   candidate={'version': candidate[0].version, 'split': candidate[1]} if candidate else None,
+                   versions=models.registry.versions())
+
+@app.route('/reload_model', methods=['POST'])
+def reload_model():
+    """Swap this worker to the current model version now, optionally activating another version first.
+
+    Other workers follow within LOAN_MODEL_WATCH_INTERVAL seconds; requests being scored meanwhile
+    finish on the version they started with.
+    """
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify(error="Access Denied!"), 403
+    models = active_models()
+    previous = active_model().version
+    previous_current = models.registry.current_version()
+    try:
+        if request.form.get('version'):
+            models.registry.activate(request.form['version'])
+        version, changed = models.reload()
+    except RegistryError as e:
+        return jsonify(error=str(e)), 404
+    except Exception as e:
+        log.exception("model reload failed")
+        if previous_current and models.registry.current_version() != previous_current:
+            # Point the other workers back at the version that loads
+            models.registry.activate(previous_current)
+        return jsonify(error=f"Could not load the model: {e}", serving=previous), 500
+    return jsonify(serving=version, previous=previous, changed=changed)
+
 @app.route('/delete_user/<int:id>')
 def delete_user(id):
     if 'role' not in session or session['role'] != 'admin':
@@ -315,6 +604,8 @@ def delete_user(id):
 
     db.session.delete(user)
     db.session.commit()
+    identity_cache.pop(id)
+    dashboard_cache.pop(id)
 
     flash('User deleted successfully', 'success')
     return redirect(url_for('manage_users'))
@@ -334,6 +625,7 @@ def deactivate_user(id):
 
     user.flag = True
     db.session.commit()
+    identity_cache.pop(id)
 
     flash('User deactivated successfully', 'warning')
     return redirect(url_for('manage_users'))
@@ -352,6 +644,7 @@ def activate_user(id):
 
     user.flag = False
     db.session.commit()
+    identity_cache.pop(id)
 
     flash('User activated successfully', 'success')
     return redirect(url_for('manage_users'))
@@ -367,103 +660,109 @@ def apply_loan():
         flash('Please log in to apply for a loan.', 'danger')
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(email=session['user_email']).first()
-    loan_application = LoanApplication.query.filter_by(user_id=user.id).first()
-    verified_user = VerifiedUser.query.filter_by(email=user.email).first()
-    customer = Customer.query.filter_by(user_id=user.id).first()
-
-    print("\n=== Loan Application Process Started ===")
-    print(f"User Email: {session['user_email']}")
-    
-    if user:
-        print(f"User Found: {user.email}, User ID: {user.id}")
-    else:
-        print("User Not Found in the System!")
+    # User, KYC record and customer profile in one round trip; the last two may be None
+    found = applicant(session['user_email']).first()
+    if found is None:
+        flash('Please log in to apply for a loan.', 'danger')
+        return redirect(url_for('login'))
+    user, verified_user, customer = found
+    user_id = user.id  # Still readable once the commit has expired the instance
 
     if request.method == 'POST':
-        print("\n--- Processing Loan Application Form ---")
-        
         try:
             income = float(request.form.get('income'))
             credit_score = int(request.form.get('credit_score'))
             loan_amount = float(request.form.get('loan_amount'))
             employment_status = request.form.get('employment_status')
 
-            aadhaar_file = request.files.get('aadhaar_file').read() if request.files.get('aadhaar_file') else None
-            pan_file = request.files.get('pan_file').read() if request.files.get('pan_file') else None
-            income_certificate_file = request.files.get('income_certificate_file').read() if request.files.get('income_certificate_file') else None
+            # Uploads are hashed as they are read; nothing is stored until they pass verification
+            uploads = receive_documents()
 
-            if not (aadhaar_file and pan_file and income_certificate_file):
+            if not all(uploads.values()):
                 flash("All required files must be uploaded!", "danger")
-                print("❌ Missing file uploads! Loan application aborted.")
+                log.info("loan application aborted: missing documents", extra={'user_id': user.id})
                 return redirect(url_for('apply_loan'))
 
             aadhaar_number = request.form.get('aadhaar_number')
             aadhaar_number = int(aadhaar_number)  # Validate Aadhaar format
-            employment_status_num = 1 if employment_status in ["Employed", "Self-Employed"] else 0
-
-            print(f"User Income: {income}, Credit Score: {credit_score}, Loan Amount: {loan_amount}")
-            print(f"Employment Status: {employment_status}, Employment Num: {employment_status_num}")
-            print(f"Aadhaar Number: {aadhaar_number}")
+            employment_status_num = encode_employment_status(employment_status)
 
+        except UploadError as e:
+            flash(str(e), 'danger')
+            log.info("loan application aborted: upload rejected", extra={'user_id': user.id, 'error': str(e)})
+            return redirect(url_for('apply_loan'))
         except ValueError:
             flash('Invalid input format.', 'danger')
-            print("❌ Error: Invalid Aadhaar or Numeric Input Format!")
+            log.info("loan application aborted: invalid input", extra={'user_id': user.id})
             return redirect(url_for('apply_loan'))
 
+        log.debug("loan application received", extra={
+            'user_id': user.id,
+            'income': income,
+            'credit_score': credit_score,
+            'loan_amount': loan_amount,
+            'employment_status': employment_status,
+            'aadhaar_number': aadhaar_number,
+        })
+
         # === CHECK IF USER EXISTS IN RBI DATABASE ===
-        print("\n--- Checking RBI Database (manage_verified_users) ---")
         if verified_user:
-            print(f"✅ User found in RBI database: {verified_user.email}")
-            print(f"🔍 Status in another bank: {verified_user.status}, Bank Count: {verified_user.bank_count}")
-
-            # Verify uploaded files match stored files
-            print("\n--- Verifying Uploaded Documents ---")
-            if (aadhaar_file != verified_user.aadhaar_file or 
-                pan_file != verified_user.pan_file or 
-                income_certificate_file != verified_user.income_certificate_file):
-                print("❌ Uploaded documents do not match verified documents!")
+            # Verify uploaded files match stored files by digest, never reading the stored documents
+            if not all(
+                document_matches(
+                    uploads[field].sha256,
+                    uploads[field].phash() if app.config['DOCUMENT_MATCH_MODE'] == 'perceptual' else None,
+                    getattr(verified_user, f'{field}_sha256'),
+                    getattr(verified_user, f'{field}_phash'),
+                    app.config['DOCUMENT_MATCH_MODE'],
+                    app.config['DOCUMENT_PHASH_MAX_DISTANCE'],
+                )
+                for field in DOCUMENT_FIELDS
+            ):
+                log.info("loan application aborted: documents do not match KYC record", extra={'user_id': user.id})
                 flash("Uploaded documents do not match our verified records!", "danger")
                 return redirect(url_for('apply_loan'))
-            print("✅ Document verification successful!")
+
+        documents = {field: store_upload(upload) for field, upload in uploads.items()}
+
+        if verified_user:
 
             # Check if user's status is False (rejected in another bank)
             if not verified_user.status:
-                print("❌ Loan was rejected in another bank. Auto-rejecting here.")  
 
                 new_loan = LoanApplication(
                     income=income,
                     credit_score=credit_score,
                     loan_amount=loan_amount,
                     employment_status=employment_status,
-                    user_id=user.id if user else None,
+                    user_id=user.id,
                     prediction='Rejected',
-                    rejection_reason="Previous rejection in another bank",
+                    rejection_reason=OTHER_BANK_REASON,
                     rejection_suggestion="Please improve your credit score or try with a different bank",
                     suggestion="Loan auto-rejected due to previous rejection in another bank",
-                    aadhaar_file=aadhaar_file,
-                    pan_file=pan_file,
-                    income_certificate_file=income_certificate_file,
-                    aadhaar_number=aadhaar_number
+                    aadhaar_number=aadhaar_number,
+                    **document_columns(documents)
                 )
 
                 db.session.add(new_loan)
+                db.session.flush()
+                loan_id = new_loan.id
+                record_new(new_loan)
                 db.session.commit()
+                dashboard_cache.pop(user_id)
 
+                log.info("loan auto-rejected: rejected in another bank", extra={'user_id': user_id, 'loan_id': loan_id})
                 flash("Loan auto-rejected due to previous rejection in another bank.", "danger")
                 return redirect(url_for('user_dashboard'))
 
-            # Increment bank_count if user is registering in this bank
-            if user and verified_user.bank_count == 1:
-                verified_user.bank_count += 1
-                print(f"🔄 User is registering in another bank. Updated Bank Count: {verified_user.bank_count}")
-                db.session.commit()
-        else:
-            print("⚠️ User not found in RBI database. Proceeding with normal loan evaluation.")
-
-        # === RUN LOAN PREDICTION ===
-        prediction = predict_loan(income, credit_score, loan_amount, employment_status_num)
-        print(f"🔮 Loan Prediction: {prediction}")
+            # Increment bank_count if user is registering in this bank. Done in SQL and only while it
+            # is still 1, so concurrent submissions cannot both bump it; committed with the application
+            if verified_user.bank_count == 1:
+                db.session.execute(
+                    update(VerifiedUser)
+                    .where(VerifiedUser.id == verified_user.id, VerifiedUser.bank_count == 1)
+                    .values(bank_count=VerifiedUser.bank_count + 1)
+                )
 
         flag = (
             verified_user
@@ -473,29 +772,25 @@ def apply_loan():
             and verified_user.aadhaar_number == aadhaar_number
         ) if verified_user else False
 
-        print(f"🔍 User Verification Status in Our Bank: {flag}")
-
         rejection_suggestion = None
-        suggested_loan_amount = loan_amount
-
-        if prediction == "Rejected":
-            print("🚨 Loan Rejected! Checking for possible improvement suggestions...")
-
-            if credit_score <= 500:
-                rejection_suggestion = f"Credit score ({credit_score}) is too low."
-            elif employment_status_num == 0:
-                rejection_suggestion = "Unemployed applicants are not eligible."
-            elif loan_amount > (income * 0.8333):  
-                suggested_loan_amount = round(income * 0.8333, 2)
-                rejection_suggestion = f"💡 Suggestion: Apply for ₹{suggested_loan_amount} or less."
-            else:
-                rejection_suggestion = "Loan denied based on internal checks."
+        if app.config['ASYNC_SCORING']:
+            # Scored later in a batch by `flask score-worker` (see scoring.py)
+            decision = {'prediction': 'Pending', 'scoring_queued_at': datetime.utcnow()}
+        else:
+            # === RUN LOAN PREDICTION ===
+            # One version for the whole request, even if a reload swaps the model meanwhile.
+            # With a candidate version set, it decides its share of applications and shadows the rest
+            model, shadow = pick_models(active_models())
+            prediction = predict_loan(income, credit_score, loan_amount, employment_status_num,
+                                      model=model, shadow=shadow)
 
-            print(f"❌ Rejection Reason: {rejection_suggestion}")
+            rejection_reason = None
+            if prediction == "Rejected":
+                rejection_reason, rejection_suggestion = explain(income, credit_score, loan_amount, employment_status_num)
 
-        # Check verified_user status again before final decision
-        final_decision = "Rejected" if not verified_user.status else ("Approved" if flag and prediction == "Approved" else "Rejected")
-        print(f"✅ Final Decision: {final_decision}")
+            # Users rejected by another bank were turned away above, so only the KYC match is left to check.
+            # The rejection reason is stored with the decision so the dashboard never has to work it out again
+            decision = decide(prediction, flag, rejection_reason, rejection_suggestion, model.version)
 
         if customer:
             customer.payment_mode = rejection_suggestion or "No Suggestion"
@@ -514,22 +809,30 @@ def apply_loan():
             loan_amount=loan_amount,
             employment_status=employment_status,
             user_id=user.id,
-            prediction=final_decision,
             flag=flag,
-            rejection_reason=rejection_suggestion if prediction == "Rejected" else None,
-            rejection_suggestion=rejection_suggestion if prediction == "Rejected" else None,
-            suggestion=rejection_suggestion if prediction == "Rejected" else "Loan application processed successfully",
-            aadhaar_file=aadhaar_file,
-            pan_file=pan_file,
-            income_certificate_file=income_certificate_file,
-            aadhaar_number=aadhaar_number
+            aadhaar_number=aadhaar_number,
+            **decision,
+            **document_columns(documents)
         )
         db.session.add(new_application)
 
+        # The one commit of the request: bank_count, customer, application and portfolio stats together
+        db.session.flush()
+        loan_id = new_application.id
+        record_new(new_application)
         db.session.commit()
-
-        print("\n✅ Loan application submitted successfully!")
-        flash(f"Loan application submitted! Status: {final_decision}", "success")
+        dashboard_cache.pop(user_id)
+
+        log.info("loan application submitted", extra={
+            'user_id': user_id,
+            'loan_id': loan_id,
+            'in_rbi_database': verified_user is not None,
+            'kyc_match': bool(flag),
+            'decision': decision['prediction'],
+            'reason': decision.get('rejection_reason'),
+            'model_version': decision.get('model_version'),
+        })
+        flash(f"Loan application submitted! Status: {decision['prediction']}", "success")
         return redirect(url_for('user_dashboard'))
 
     return render_template('apply_loan.html')
@@ -547,10 +850,7 @@ def update_loan_status(id):
         return redirect(url_for('manage_verified_users'))
 
     new_status = request.form.get('loan_status')
-    print(f"\n=== Updating Loan Status ===")
-    print(f"User ID: {id}")
-    print(f"Current Status: {user.status}")
-    print(f"New Status: {new_status}")
+    old_status = user.status
 
     if new_status not in ["Pending", "Approved", "Rejected"]:
         flash("Invalid status!", "danger")
@@ -562,13 +862,12 @@ def update_loan_status(id):
 
     try:
         db.session.commit()
-        print(f"✅ Status updated successfully!")
-        print(f"New Status: {user.status}")
-        print(f"Loan Status in Other Bank: {user.loan_status_in_other_bank}")
+        log.info("verified user status updated",
+                 extra={'verified_user_id': id, 'old_status': old_status, 'new_status': new_status})
         flash("Loan status updated successfully!", "success")
-    except Exception as e:
+    except Exception:
         db.session.rollback()
-        print(f"❌ Error updating status: {str(e)}")
+        log.exception("verified user status update failed", extra={'verified_user_id': id, 'new_status': new_status})
         flash("Error updating loan status!", "danger")
 
     return redirect(url_for('manage_verified_users'))
@@ -582,26 +881,32 @@ def update_loan_status(id):
 #----------------------------------------------------------------ROUTER NOT IN USE ----------------------------------------------------------------
 @app.route('/download/<email>/<file_type>')
 def download_file(email, file_type):
-    user = VerifiedUser.query.filter_by(email=email).first()
-    if not user:
-        return "User not found", 404
-
-    file_data = None
-    filename = None
-
-    if file_type == 'aadhaar' and user.aadhaar_file:
-        file_data = user.aadhaar_file
-        filename = "aadhaar.pdf"  # Adjust file extension as needed
-    elif file_type == 'pan' and user.pan_file:
-        file_data = user.pan_file
-        filename = "pan.pdf"
-    elif file_type == 'income_certificate' and user.income_certificate_file:
-        file_data = user.income_certificate_file
-        filename = "income_certificate.pdf"
-
-    if file_data:
-        return send_file(io.BytesIO(file_data), as_attachment=True, download_name=filename)
-    return "File not found", 404
+    if session.get('role') != 'admin' and session.get('user_email') != email:
+        return "Access Denied!", 403
+
+    if f'{file_type}_file' not in DOCUMENT_FIELDS:
+        return "File not found", 404
+
+    column = getattr(VerifiedUser, f'{file_type}_file_sha256')
+    digest = db.session.query(column).filter(VerifiedUser.email == email).scalar()
+    if not blob_store.exists(digest):
+        return "File not found", 404
+
+    # Served straight from disk (sendfile / X-Sendfile when USE_X_SENDFILE is on) with Range
+    # support, and the content hash as a strong ETag so repeat views get a 304
+    mimetype, extension = blob_store.sniff(digest)
+    response = send_file(
+        blob_store.path_for(digest),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"{file_type}.{extension}",
+        etag=digest,
+        conditional=True,
+    )
+    response.cache_control.private = True
+    if response.status_code in (200, 206):
+        count_blob_bytes('read', response.content_length)
+    return response
 
 
 
@@ -610,7 +915,7 @@ def add_samples():
     if 'user_email' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.filter_by(email=session['user_email']).first()
+    user = g.user
     
     samples = [
         {'amount': 12000, 'category': 'food', 'description': 'Monthly groceries', 'type': 'debit'},
@@ -645,8 +950,11 @@ def approve_loan(id):
         return redirect(url_for('home'))
 
     loan = LoanApplication.query.get_or_404(id)
+    old_prediction = loan.prediction
     loan.prediction = "Approved"
+    record_change(loan, old_prediction)
     db.session.commit()
+    dashboard_cache.pop(loan.user_id)
 
     flash("Loan approved successfully!", "success")
     return redirect(url_for('manage_loans'))
@@ -658,8 +966,17 @@ def reject_loan(id):
         return redirect(url_for('home'))
 
     loan = LoanApplication.query.get_or_404(id)
+    old_prediction = loan.prediction
     loan.prediction = "Rejected"
+    if not loan.rejection_reason:
+        reason, suggestion = evaluate(
+            loan.income, loan.credit_score, loan.loan_amount, encode_employment_status(loan.employment_status)
+        ).messages(0)
+        loan.rejection_reason = reason or "❌ REJECTED: Declined after manual review"
+        loan.rejection_suggestion = loan.rejection_suggestion or suggestion
+    record_change(loan, old_prediction)
     db.session.commit()
+    dashboard_cache.pop(loan.user_id)
 
     flash("Loan rejected successfully!", "danger")
     return redirect(url_for('manage_loans'))
@@ -673,8 +990,40 @@ def manage_loans():
         flash("Access Denied!", "danger")
         return redirect(url_for('login'))
 
-    users = User.query.all()
-    return render_template('manage_loans.html', users=users)
+    # One bounded query per page: applicant joined in, only the listed columns loaded
+    filters = {
+        'status': request.args.get('status') if request.args.get('status') in ("Pending", "Approved", "Rejected") else '',
+        'min_amount': request.args.get('min_amount', type=float),
+        'max_amount': request.args.get('max_amount', type=float),
+        'date_from': request.args.get('date_from', type=date.fromisoformat),
+        'date_to': request.args.get('date_to', type=date.fromisoformat),
+        'sort': request.args.get('sort') if request.args.get('sort') in LOAN_SORTS else 'newest',
+    }
+    try:
+        loans = loan_listing(
+            status=filters['status'],
+            min_amount=filters['min_amount'],
+            max_amount=filters['max_amount'],
+            date_from=filters['date_from'],
+            # The "to" date is inclusive
+            date_to=filters['date_to'] + timedelta(days=1) if filters['date_to'] else None,
+            sort=filters['sort'],
+            after=request.args.get('after'),
+            limit=LOANS_PAGE_SIZE + 1,
+        ).all()
+    except ValueError:
+        flash("Invalid page cursor!", "danger")
+        return redirect(url_for('manage_loans'))
+
+    next_cursor = encode_cursor(loans[LOANS_PAGE_SIZE - 1], filters['sort']) if len(loans) > LOANS_PAGE_SIZE else None
+    loans = loans[:LOANS_PAGE_SIZE]
+
+    # Each applicant on this page with their most relevant application
+    applicants = {}
+    for loan in loans:
+        applicants.setdefault(loan.user_id, loan)
+    filters = {name: value for name, value in filters.items() if value not in (None, '')}
+    return render_template('manage_loans.html', loans=loans, applicants=applicants.values(), filters=filters, next_cursor=next_cursor)
 @app.route('/delete_verified_user/<int:id>')
 def delete_verified_user(id):
     if 'role' not in session or session['role'] != 'admin':
@@ -689,10 +1038,289 @@ def delete_verified_user(id):
     return redirect(url_for('manage_verified_users'))
 
 
+#----------------------------------------------------------------API----------------------------------------------------------------
+@app.route('/api/score_batch', methods=['POST'])
+def score_batch():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify(error="Access Denied!"), 403
+
+    payload = request.get_json(silent=True) or {}
+    applications = payload.get('applications')
+    if not isinstance(applications, list):
+        return jsonify(error="Expected a JSON body with an 'applications' list"), 400
+
+    rows = np.empty((len(applications), len(FEATURES)), dtype=np.float64)
+    try:
+        for i, application in enumerate(applications):
+            if isinstance(application, dict):
+                application = [application[name] for name in FEATURES]
+            income, credit_score, loan_amount, employment_status = application
+            if isinstance(employment_status, str):
+                employment_status = encode_employment_status(employment_status)
+            rows[i] = (float(income), int(credit_score), float(loan_amount), int(employment_status))
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error=f"Invalid application at index {i}"), 400
+
+    decisions, probabilities = predict_loans(rows)
+    return jsonify(decisions=decisions, probabilities=probabilities.tolist())
+
+
 #------------------------------------------------------------------------------------------------------------------------------
 
+#----------------------------------------------------------------CLI----------------------------------------------------------------
+@app.cli.command('migrate')
+def migrate_command():
+    """Add missing columns and indexes to an existing database."""
+    upgrade_schema()
+    click.echo("Schema is up to date")
+
+
+@app.cli.command('explain-queries')
+@click.option('--strict', is_flag=True, help='Exit with status 1 if any query does a full table scan.')
+def explain_queries_command(strict):
+    """Print the SQLite query plan of every hot query."""
+    full_scans = 0
+    for name, sql, plan in explain_queries():
+        click.echo(f"== {name}")
+        click.echo(f"   {sql}".replace('\n', ' '))
+        for detail in plan:
+            flagged = is_full_scan(detail)
+            full_scans += flagged
+            click.echo(f"   {'!!' if flagged else '->'} {detail}")
+    click.echo(f"{full_scans} full table scan(s)")
+    if strict and full_scans:
+        raise SystemExit(1)
+
+@app.cli.command('migrate-blobs')
+@click.option('--batch-size', default=100, show_default=True, help='Rows moved per transaction.')
+@click.option('--drop-columns', is_flag=True, help='Drop the legacy LargeBinary columns afterwards (SQLite 3.35+).')
+def migrate_blobs_command(batch_size, drop_columns):
+    """Move documents out of LargeBinary columns into the blob store."""
+    moved = migrate_blobs(blob_store, batch_size=batch_size, drop_columns=drop_columns, log=click.echo)
+    click.echo(f"Moved {moved} documents into {blob_store.root}")
+
+
+@app.cli.command('reevaluate-rejections')
+@click.option('--batch-size', default=1000, show_default=True, help='Applications evaluated per transaction.')
+def reevaluate_rejections_command(batch_size):
+    """Recompute the stored rejection reason and suggestion of every rejected application."""
+    columns = (LoanApplication.id, LoanApplication.income, LoanApplication.credit_score,
+               LoanApplication.loan_amount, LoanApplication.employment_status)
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(*columns)
+                .filter(LoanApplication.prediction == 'Rejected', LoanApplication.id > last_id)
+                .order_by(LoanApplication.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        ids, income, credit_score, loan_amount, employment_status = zip(*rows)
+        reasons, suggestions = evaluate(
+            income, credit_score, loan_amount, encode_employment_status(list(employment_status))
+        ).all_messages()
+        # Rows that break no rule keep what was stored when they were rejected (e.g. a KYC mismatch)
+        db.session.execute(update(LoanApplication), [
+            {'id': i, 'rejection_reason': reason, 'rejection_suggestion': suggestion}
+            for i, reason, suggestion in zip(ids, reasons, suggestions) if reason
+        ])
+        db.session.commit()
+        updated += sum(1 for reason in reasons if reason)
+        last_id = ids[-1]
+    dashboard_cache.clear()
+    click.echo(f"Updated {updated} rejected applications")
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the admin dashboard's portfolio statistics from loan_application."""
+    rows = rebuild_stats()
+    click.echo(f"Rebuilt {rows} portfolio statistics rows")
+
+
+@app.cli.command('export-applications')
+@click.option('--out', default=None, help='Export directory (default: LOAN_ANALYTICS_EXPORT_DIR).')
+@click.option('--format', 'file_format', default='auto', show_default=True,
+              type=click.Choice(('auto',) + EXPORT_FORMATS), help='auto picks parquet when pyarrow is installed, else npz.')
+@click.option('--chunk-size', default=EXPORT_CHUNK_SIZE, show_default=True, help='Rows read from the database per query.')
+@click.option('--full', is_flag=True, help='Start the export over instead of continuing from its watermark.')
+@click.option('--lag', default=5, show_default=True, help='Leave out rows updated in the last N seconds.')
+def export_applications_command(out, file_format, chunk_size, full, lag):
+    """Export loan applications changed since the last run to a columnar file for offline modelling."""
+    out = out or app.config['ANALYTICS_EXPORT_DIR']
+    try:
+        manifest = export_applications(out, file_format, chunk_size=chunk_size, full=full, lag=lag, log=click.echo)
+    except ExportError as e:
+        raise click.ClickException(str(e))
+    total = sum(part['rows'] for part in manifest['parts'])
+    click.echo(f"{out}: {len(manifest['parts'])} parts, {total} rows, watermark {manifest['watermark']}")
+
+
+@app.cli.command('train-model')
+@click.option('--from-export', 'export_dir', default=None, help='Train from a columnar export instead of the database.')
+@click.option('--chunk-size', default=training.DEFAULT_CHUNK_SIZE, show_default=True, help='Applications per training chunk.')
+@click.option('--trees', default=training.DEFAULT_TREES, show_default=True, help='Trees in the forest, spread over the chunks.')
+@click.option('--max-depth', default=training.DEFAULT_MAX_DEPTH, show_default=True)
+@click.option('--jobs', default=-1, show_default=True, help='Trees built in parallel (-1: one per CPU).')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--min-rows', default=training.DEFAULT_MIN_ROWS, show_default=True, help='Refuse to train on less history.')
+@click.option('--out', default=MODEL_PATH, show_default=True, help='Where to write the pickled model.')
+@click.option('--artifact', default=ARTIFACT_PATH, show_default=True, help='Where to write the memory-mappable artifact.')
+@click.option('--publish', is_flag=True, help='Also publish the model to the registry and make it current.')
+def train_model_command(export_dir, chunk_size, trees, max_depth, jobs, seed, min_rows, out, artifact, publish):
+    """Train the loan model on recorded decisions and admin overrides, streaming the history in chunks."""
+    if export_dir:
+        history = training.ExportHistory(export_dir, chunk_size)
+    else:
+        history = training.DatabaseHistory(chunk_size)
+    try:
+        model, metadata = training.train_from_history(
+            history, n_trees=trees, max_depth=max_depth, n_jobs=jobs, seed=seed, min_rows=min_rows, log=click.echo
+        )
+    except training.TrainingError as e:
+        raise click.ClickException(str(e))
+    save_model(model, out)
+    export_artifact(model, artifact, source=out, metadata=metadata)
+    click.echo(json.dumps(metadata['metrics'], indent=2))
+    click.echo(f"Model written to {out}, artifact to {artifact}")
+    if publish:
+        version = active_models().registry.publish(out, artifact)
+        click.echo(f"Published and activated model version {version}")
+
+
+@app.cli.command('publish-model')
+@click.option('--model', 'model_path', default=MODEL_PATH, show_default=True, help='Pickled model to publish.')
+@click.option('--artifact', default=ARTIFACT_PATH, show_default=True, help='Its artifact (exported if missing).')
+@click.option('--activate/--no-activate', default=True, show_default=True, help='Make it the current version.')
+def publish_model_command(model_path, artifact, activate):
+    """Copy a model into the registry as a new version. Running workers switch to it without a restart."""
+    version = active_models().registry.publish(model_path, artifact, activate=activate)
+    click.echo(f"Published model version {version}{' (current)' if activate else ''}")
+
+
+@app.cli.command('activate-model')
+@click.argument('version')
+def activate_model_command(version):
+    """Make VERSION the current model (also how to roll back). Workers follow on their next check."""
+    try:
+        active_models().registry.activate(version)
+    except RegistryError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Model version {version} is now current")
+
+
+@app.cli.command('list-models')
+def list_models_command():
+    """List published model versions with their holdout accuracy."""
+    for entry in active_models().registry.versions():
+        accuracy = entry['metadata'].get('metrics', {}).get('accuracy')
+        click.echo(f"{'*' if entry['current'] else '~' if entry['candidate'] else ' '} {entry['version']}"
+                   f"{f'  accuracy {accuracy:.4f}' if accuracy is not None else ''}")
+
+
+@app.cli.command('candidate-model')
+@click.argument('version', required=False)
+@click.option('--split', default=0.0, show_default=True,
+              help='Percentage of applications the candidate decides; it shadows the rest.')
+@click.option('--clear', is_flag=True, help='End the experiment: score with the current version only.')
+def candidate_model_command(version, split, clear):
+    """Shadow-score VERSION against the current model, or show the candidate without arguments."""
+    registry = active_models().registry
+    if clear:
+        registry.clear_candidate()
+        click.echo("No candidate model")
+        return
+    if version is None:
+        candidate = registry.candidate()
+        click.echo(f"Candidate {candidate['version']}, deciding {candidate['split']:g}% of applications"
+                   if candidate else "No candidate model")
+        return
+    try:
+        registry.set_candidate(version, split)
+    except RegistryError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Model version {version} is the candidate, deciding {split:g}% of applications")
+
+
+@app.cli.command('shadow-report')
+@click.option('--hours', default=24.0, show_default=True, help='How far back to look.')
+def shadow_report_command(hours):
+    """Agreement and latency between live and shadow model versions."""
+    report = shadow_report(datetime.utcnow() - timedelta(hours=hours))
+    if not report:
+        click.echo(f"No shadow comparisons in the last {hours:g} hours")
+    for entry in report:
+        click.echo(
+            f"{entry['live_version']} vs {entry['shadow_version']} (shadow)"
+            f"{' [candidate deciding]' if entry['candidate_decided'] else ''}\n"
+            f"  {entry['comparisons']} comparisons, {entry['disagreements']} disagreements "
+            f"({entry['disagreement_rate']:.2%})\n"
+            f"  approval rate {entry['live_approval_rate']:.2%} live, {entry['shadow_approval_rate']:.2%} shadow\n"
+            f"  {entry['live_ms']:.3f} ms live, {entry['shadow_ms']:.3f} ms shadow "
+            f"({entry['latency_delta_ms']:+.3f} ms per application)"
+        )
+
+
+@app.cli.command('db-profile')
+def db_profile_command():
+    """Show the database profile, pool and (for SQLite) PRAGMA settings in effect."""
+    for name, value in database_report(db.engine).items():
+        if isinstance(value, dict):
+            click.echo(f"{name}:")
+            for key, item in value.items():
+                click.echo(f"  {key}: {item}")
+        else:
+            click.echo(f"{name}: {value}")
 
 
+@app.cli.command('import-kyc')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--documents', 'documents_dir', type=click.Path(exists=True, file_okay=False), default='.',
+              show_default=True, help='Directory the manifest\'s document file names are relative to.')
+@click.option('--batch-size', default=1000, show_default=True, help='Records upserted per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and import from the first row.')
+def import_kyc_command(manifest, documents_dir, batch_size, restart):
+    """Bulk upsert VerifiedUser records from a CSV/JSONL manifest (resumable)."""
+    try:
+        state = run_kyc_import(manifest, documents_dir, batch_size=batch_size, restart=restart, log=click.echo)
+    except KycImportError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Imported {state['imported']} records, {state['failed']} errors")
+    if state['failed']:
+        click.echo(f"Rejected rows: {errors_path(manifest)}")
+
+
+def score_worker_process(batch_size, poll_interval, stale_after, once):
+    with app.app_context():
+        # Never share the parent's pooled connections with a forked worker
+        db.engine.dispose(close=False)
+        return run_worker(predict_loans, batch_size=batch_size, poll_interval=poll_interval,
+                          stale_after=stale_after, once=once, log=click.echo)
+
+@app.cli.command('score-worker')
+@click.option('--batch-size', default=256, show_default=True, help='Applications scored per predict call.')
+@click.option('--processes', default=1, show_default=True, help='Worker processes to run.')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds to wait when the queue is empty.')
+@click.option('--stale-after', default=300, show_default=True, help='Seconds before a dead worker\'s claim is taken over.')
+@click.option('--once', is_flag=True, help='Exit once the queue is drained instead of polling.')
+def score_worker_command(batch_size, processes, poll_interval, stale_after, once):
+    """Score applications queued by apply_loan when LOAN_ASYNC_SCORING is on."""
+    import multiprocessing
+
+    click.echo(f"{queue_length()} applications queued; starting {processes} worker(s)")
+    args = (batch_size, poll_interval, stale_after, once)
+    if processes == 1:
+        scored = score_worker_process(*args)
+        click.echo(f"Scored {scored} applications")
+        return
+
+    workers = [multiprocessing.Process(target=score_worker_process, args=args) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
 
 if __name__ == '__main__':
     app.run(debug=True)
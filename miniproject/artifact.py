@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from flatforest import FlatForest
+
+# Bump whenever the on-disk layout or the meaning of an array changes
+FORMAT_NAME = 'flatforest'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+DTYPES = {
+    'feature': np.int64,
+    'threshold': np.float64,
+    'left': np.int64,
+    'right': np.int64,
+    'value': np.float64,
+    'roots': np.int64,
+}
+
+
+class ArtifactError(Exception):
+    """Raised when a model artifact is missing, corrupt, stale or of the wrong format."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_artifact(forest, path, features, source=None, metadata=None):
+    """Write forest (a FlatForest or a fitted RandomForestClassifier) as a directory of .npy files.
+
+    source is the pickle the forest came from; its hash is recorded so a later load
+    can tell that the artifact no longer matches it. metadata (e.g. how the model was
+    trained and its metrics) is stored in the manifest as is.
+
+    Re-exporting to a path that workers have memory-mapped is safe: every export writes
+    its arrays under new file names and only the manifest swap switches to them, so a
+    loaded forest keeps reading the files it mapped until it is reloaded.
+    """
+    if not isinstance(forest, FlatForest):
+        forest = FlatForest.from_sklearn(forest)
+
+    os.makedirs(path, exist_ok=True)
+    try:
+        previous = read_manifest(path)
+    except ArtifactError:
+        previous = None
+    export_id = uuid.uuid4().hex[:12]
+    arrays = {}
+    for name in ARRAYS:
+        filename = f'{name}-{export_id}.npy'
+        np.save(os.path.join(path, filename), np.ascontiguousarray(getattr(forest, name), dtype=DTYPES[name]))
+        arrays[name] = {'file': filename, 'sha256': file_sha256(os.path.join(path, filename))}
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'format_version': FORMAT_VERSION,
+        'features': list(features),
+        'classes': [int(c) for c in forest.classes_],
+        'depth': forest.depth,
+        'n_trees': len(forest.roots),
+        'source_sha256': file_sha256(source) if source else None,
+        'arrays': arrays,
+        'metadata': metadata or {},
+    }
+    # Written last so a half-exported directory never looks valid
+    tmp_path = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+    _remove_unused_arrays(path, manifest, previous)
+    return manifest
+
+
+def _remove_unused_arrays(path, manifest, previous):
+    """Delete array files neither manifest names.
+
+    The previous export's files are kept, so a load that read the old manifest just
+    before the swap can still open them; they go with the next export. Unlinking a file
+    a process still has mapped leaves its mapping intact.
+    """
+    keep = {entry['file'] for m in (manifest, previous) if m for entry in m.get('arrays', {}).values()}
+    for filename in os.listdir(path):
+        if filename.endswith('.npy') and filename not in keep:
+            try:
+                os.unlink(os.path.join(path, filename))
+            except OSError:
+                pass  # e.g. still mapped on Windows; removed by a later export
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"Cannot read model manifest in {path}: {e}")
+
+
+def load_artifact(path, features, source=None, verify=True):
+    """Open an artifact with every array memory-mapped read-only.
+
+    Workers that load the same artifact share its pages through the OS page cache.
+    Raises ArtifactError if the format version or feature list differ, if an array's
+    checksum does not match the manifest (when verify is set), or if source exists and
+    is not the pickle the artifact was exported from.
+    """
+    manifest = read_manifest(path)
+    if manifest.get('format') != FORMAT_NAME or manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(
+            f"Unsupported model artifact {manifest.get('format')} v{manifest.get('format_version')}, "
+            f"expected {FORMAT_NAME} v{FORMAT_VERSION}"
+        )
+    if manifest['features'] != list(features):
+        raise ArtifactError(f"Model artifact features {manifest['features']} do not match {list(features)}")
+    if source and manifest.get('source_sha256') and os.path.exists(source):
+        if file_sha256(source) != manifest['source_sha256']:
+            raise ArtifactError(f"Model artifact {path} is stale: {source} has changed since it was exported")
+
+    arrays = {}
+    for name in ARRAYS:
+        entry = manifest['arrays'][name]
+        array_path = os.path.join(path, entry['file'])
+        if verify and file_sha256(array_path) != entry['sha256']:
+            raise ArtifactError(f"Checksum mismatch for {array_path}")
+        arrays[name] = np.load(array_path, mmap_mode='r')
+
+    return FlatForest(classes=manifest['classes'], depth=manifest['depth'], **arrays)
@@ -0,0 +1,470 @@
+"""End-to-end benchmark of the loan application.
+
+Seeds a throwaway SQLite database and blob store with synthetic users, KYC records
+(with documents) and applications, then drives the main routes through the Flask test
+client or a local HTTP server and reports throughput and p50/p95/p99 latency per
+route. It also times predict_loan one row at a time against predict_loans on a batch.
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmark.py --users 200 --applications 5000 --requests 300 --concurrency 4 --output bench.json
+    python benchmark.py --mode http --concurrency 16
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUTES = ('register', 'login', 'apply_loan', 'user_dashboard', 'manage_loans', 'manage_verified_users', 'admin_dashboard')
+EMPLOYMENT_STATUSES = ('Employed', 'Self-Employed', 'Unemployed')
+PASSWORD = 'bench-password'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100, help='Customers (each with a KYC record) to seed.')
+    parser.add_argument('--applications', type=int, default=2000, help='Loan applications to seed.')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per route.')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per route before timing.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Threads issuing requests.')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help='Flask test client, or real HTTP against a local threaded server.')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated routes to run.')
+    parser.add_argument('--doc-size', type=int, default=64 * 1024, help='Bytes per synthetic KYC document.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows per predict_loans call.')
+    parser.add_argument('--predict-iterations', type=int, default=2000, help='Single-row predict_loan calls to time.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary database and blob store.')
+    return parser.parse_args(argv)
+
+
+#----------------------------------------------------------------ENVIRONMENT----------------------------------------------------------------
+def prepare_environment(workdir):
+    """Point the app at a private database, blob store and log file before it is imported."""
+    os.environ['LOAN_DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.sqlite3')
+    os.environ['LOAN_BLOB_STORE'] = os.path.join(workdir, 'blobs')
+    os.environ.setdefault('LOAN_LOG_FILE', os.path.join(workdir, 'app.log'))
+    os.environ.setdefault('LOAN_QUERY_BUDGET', '1000000')
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    import app as appmod
+    return appmod
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#----------------------------------------------------------------SEEDING----------------------------------------------------------------
+def synthetic_document(rng, size):
+    # A PDF header so the blob store sniffs it as a real document
+    return b'%PDF-1.4\n' + rng.bytes(max(size - 9, 0))
+
+
+def seed(appmod, args, rng):
+    """Create users, KYC records with documents, and applications. Returns what the scenarios need."""
+    from sqlalchemy import insert
+    from models import db, User, Role, VerifiedUser, LoanApplication, DOCUMENT_FIELDS
+    from stats import rebuild_stats
+
+    app, blob_store = appmod.app, appmod.blob_store
+    customers = []
+    with app.app_context():
+        role_id = Role.query.filter_by(name='customer').one().id
+
+        def kyc_record(email):
+            documents = {field: synthetic_document(rng, args.doc_size) for field in DOCUMENT_FIELDS}
+            row = bare_kyc_record(email, rng)
+            for field, data in documents.items():
+                row[f'{field}_sha256'], row[f'{field}_size'] = blob_store.put_bytes(data)
+            return row, documents
+
+        users, verified = [], []
+        for i in range(args.users):
+            email = f'customer{i}@bench.test'
+            users.append({'name': f'Customer {i}', 'email': email, 'password': PASSWORD, 'role_id': role_id})
+            row, documents = kyc_record(email)
+            verified.append(row)
+            customers.append({**row, 'documents': documents})
+
+        # KYC records for people who will register during the run (register needs one to exist)
+        registrations = [f'new{i}@bench.test' for i in range(args.requests + max(args.warmup, args.concurrency))]
+        verified.extend(bare_kyc_record(email, rng) for email in registrations)
+
+        db.session.execute(insert(User), users)
+        db.session.execute(insert(VerifiedUser), verified)
+        db.session.commit()
+
+        user_ids = dict(db.session.query(User.email, User.id).filter(User.role_id == role_id))
+        now = datetime.utcnow()
+        applications = []
+        for i in range(args.applications):
+            if not customers:
+                break
+            customer = customers[rng.randint(0, len(customers))]
+            applications.append({
+                'user_id': user_ids[customer['email']],
+                'income': customer['correct_income'],
+                'credit_score': customer['correct_credit_score'],
+                'loan_amount': float(rng.randint(1000, 200000)),
+                'employment_status': customer['employment_status'],
+                'prediction': ('Approved', 'Rejected', 'Pending')[rng.randint(0, 3)],
+                'aadhaar_number': customer['aadhaar_number'],
+                'created_at': now - timedelta(minutes=int(rng.randint(0, 60 * 24 * 365))),
+            })
+        for start in range(0, len(applications), 5000):
+            db.session.execute(insert(LoanApplication), applications[start:start + 5000])
+        db.session.commit()
+        # Bulk inserts bypass the write hooks, so build the dashboard statistics in one pass
+        rebuild_stats()
+
+    return {'customers': customers, 'registrations': registrations}
+
+
+def bare_kyc_record(email, rng):
+    # Registration only needs the record to exist, so these get no documents
+    return {
+        'email': email,
+        'correct_income': float(rng.randint(20000, 150000)),
+        'correct_credit_score': int(rng.randint(300, 850)),
+        'employment_status': EMPLOYMENT_STATUSES[rng.randint(0, len(EMPLOYMENT_STATUSES))],
+        'aadhaar_number': int(rng.randint(10 ** 11, 10 ** 12 - 1, dtype=np.int64)),
+        'bank_count': 1,
+        'status': True,
+    }
+
+
+#----------------------------------------------------------------DRIVERS----------------------------------------------------------------
+class TestClientSession:
+    """One logged-in browser, backed by the Flask test client (no sockets)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data, files=None):
+        if files:
+            data = {**data, **{name: (io.BytesIO(content), filename) for name, (filename, content) in files.items()}}
+            return self.client.post(path, data=data, content_type='multipart/form-data').status_code
+        return self.client.post(path, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """One logged-in browser talking HTTP to a local server; redirects are not followed."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def _send(self, request):
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, data, files=None):
+        if files:
+            body, content_type = encode_multipart(data, files)
+        else:
+            body, content_type = urllib.parse.urlencode(data).encode(), 'application/x-www-form-urlencoded'
+        return self._send(urllib.request.Request(
+            self.base_url + path, data=body, headers={'Content-Type': content_type}, method='POST'
+        ))
+
+
+def encode_multipart(data, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in data.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+#----------------------------------------------------------------SCENARIOS----------------------------------------------------------------
+def login(session, email, password=PASSWORD):
+    status = session.post('/login', {'email': email, 'password': password})
+    if status != 302:
+        raise RuntimeError(f"Login as {email} failed with HTTP {status}")
+
+
+def scenarios(seeded):
+    """route -> (setup(session, worker), request(session, worker, i) -> status)."""
+    customers = seeded['customers']
+    registrations = iter(seeded['registrations'])
+    registrations_lock = threading.Lock()
+
+    def customer_for(worker):
+        return customers[worker % len(customers)]
+
+    def as_customer(session, worker):
+        login(session, customer_for(worker)['email'])
+
+    def as_admin(session, worker):
+        login(session, 'admin@gmail.com', 'admin')
+
+    def register(session, worker, i):
+        with registrations_lock:
+            email = next(registrations)
+        return session.post('/register', {'name': 'New Customer', 'email': email, 'password': PASSWORD})
+
+    def do_login(session, worker, i):
+        return session.post('/login', {'email': customer_for(worker + i)['email'], 'password': PASSWORD})
+
+    def apply_loan(session, worker, i):
+        customer = customer_for(worker)
+        form = {
+            'income': customer['correct_income'],
+            'credit_score': customer['correct_credit_score'],
+            'loan_amount': float(1000 + (i * 997) % 150000),
+            'employment_status': customer['employment_status'],
+            'aadhaar_number': customer['aadhaar_number'],
+        }
+        files = {field: (f'{field}.pdf', content) for field, content in customer['documents'].items()}
+        return session.post('/apply_loan', form, files)
+
+    def manage_loans(session, worker, i):
+        # Alternate between the first page and a filtered listing
+        return session.get('/manage_loans' if i % 2 == 0 else '/manage_loans?status=Rejected&sort=amount_desc')
+
+    return {
+        'register': (None, register),
+        'login': (None, do_login),
+        'apply_loan': (as_customer, apply_loan),
+        'user_dashboard': (as_customer, lambda session, worker, i: session.get('/user_dashboard')),
+        'manage_loans': (as_admin, manage_loans),
+        'manage_verified_users': (as_admin, lambda session, worker, i: session.get('/manage_verified_users')),
+        'admin_dashboard': (as_admin, lambda session, worker, i: session.get('/admin_dashboard')),
+    }
+
+
+def run_route(make_session, setup, call, requests, warmup, concurrency):
+    """Issue warmup + requests calls over concurrency threads. Returns (latencies in s, statuses, wall s)."""
+    per_worker = [requests // concurrency + (1 if w < requests % concurrency else 0) for w in range(concurrency)]
+    warmup_per_worker = max(warmup // concurrency, 1) if warmup else 0
+    sessions = []
+    for worker in range(concurrency):
+        session = make_session()
+        if setup:
+            setup(session, worker)
+        sessions.append(session)
+
+    start_barrier = threading.Barrier(concurrency)
+
+    def work(worker):
+        session = sessions[worker]
+        for i in range(warmup_per_worker):
+            call(session, worker, i)
+        start_barrier.wait()
+        timed_from = time.perf_counter()
+        results = []
+        for i in range(per_worker[worker]):
+            started = time.perf_counter()
+            status = call(session, worker, warmup_per_worker + i)
+            results.append((time.perf_counter() - started, status))
+        return results, timed_from, time.perf_counter()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(work, range(concurrency)))
+
+    # Wall time of the timed section only (warmup and logins excluded)
+    wall = max(end for _, _, end in outcomes) - min(start for _, start, _ in outcomes)
+    latencies = [lat for results, _, _ in outcomes for lat, _ in results]
+    statuses = [status for results, _, _ in outcomes for _, status in results]
+    return latencies, statuses, wall
+
+
+def summarize(latencies, statuses, wall):
+    ms = np.asarray(latencies) * 1000
+    errors = sum(1 for status in statuses if status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'status_codes': {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        'throughput_rps': round(len(latencies) / wall, 2) if wall > 0 else None,
+        'mean_ms': round(float(ms.mean()), 3) if len(ms) else None,
+        'p50_ms': round(float(np.percentile(ms, 50)), 3) if len(ms) else None,
+        'p95_ms': round(float(np.percentile(ms, 95)), 3) if len(ms) else None,
+        'p99_ms': round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+        'max_ms': round(float(ms.max()), 3) if len(ms) else None,
+    }
+
+
+#----------------------------------------------------------------INFERENCE----------------------------------------------------------------
+def benchmark_inference(appmod, args, rng):
+    """Per-row cost of predict_loan (one row per call) against predict_loans (one call per batch)."""
+    rows = np.column_stack([
+        rng.randint(20000, 150000, args.batch_size),
+        rng.randint(300, 850, args.batch_size),
+        rng.randint(1000, 200000, args.batch_size),
+        rng.randint(0, 2, args.batch_size),
+    ]).astype(np.float64)
+
+    results = {}
+    for engine in ('flat', 'sklearn'):
+        try:
+            appmod.get_engine(engine)
+        except Exception as e:  # e.g. no exported artifact for the flat engine
+            results[engine] = {'error': str(e)}
+            continue
+
+        appmod.predict_loan(*rows[0], engine=engine)
+        single = []
+        for i in range(args.predict_iterations):
+            row = rows[i % len(rows)]
+            started = time.perf_counter()
+            appmod.predict_loan(*row, engine=engine)
+            single.append(time.perf_counter() - started)
+
+        appmod.predict_loans(rows, engine=engine)
+        batch = []
+        for _ in range(max(args.predict_iterations // args.batch_size, 5)):
+            started = time.perf_counter()
+            appmod.predict_loans(rows, engine=engine)
+            batch.append(time.perf_counter() - started)
+
+        single_us = np.asarray(single) * 1e6
+        batch_us = np.asarray(batch) * 1e6
+        results[engine] = {
+            'single_p50_us': round(float(np.percentile(single_us, 50)), 2),
+            'single_p99_us': round(float(np.percentile(single_us, 99)), 2),
+            'batch_size': args.batch_size,
+            'batch_p50_us': round(float(np.percentile(batch_us, 50)), 2),
+            'batch_per_row_us': round(float(np.percentile(batch_us, 50)) / args.batch_size, 3),
+            'speedup_per_row': round(float(np.percentile(single_us, 50)) /
+                                     (float(np.percentile(batch_us, 50)) / args.batch_size), 1),
+        }
+    return results
+
+
+#----------------------------------------------------------------MAIN----------------------------------------------------------------
+def print_report(results):
+    print(f"\n{'route':<24}{'reqs':>6}{'errs':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in results['routes'].items():
+        print(f"{route:<24}{stats['requests']:>6}{stats['errors']:>6}{stats['throughput_rps'] or 0:>10.1f}"
+              f"{stats['p50_ms'] or 0:>10.2f}{stats['p95_ms'] or 0:>10.2f}{stats['p99_ms'] or 0:>10.2f}")
+    print()
+    for engine, stats in results['inference'].items():
+        if 'error' in stats:
+            print(f"{engine}: skipped ({stats['error']})")
+        else:
+            print(f"{engine}: single row p50 {stats['single_p50_us']} us, batch of {stats['batch_size']} "
+                  f"{stats['batch_per_row_us']} us/row ({stats['speedup_per_row']}x)")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"Unknown routes: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='loan-bench-')
+    rng = np.random.RandomState(args.seed)
+    appmod = prepare_environment(workdir)
+    app = appmod.app
+
+    started = time.perf_counter()
+    seeded = seed(appmod, args, rng)
+    print(f"Seeded {args.users} users and {args.applications} applications in "
+          f"{time.perf_counter() - started:.1f}s ({workdir})")
+
+    server = None
+    if args.mode == 'http':
+        server, base_url = start_server(app)
+        make_session = lambda: HttpSession(base_url)
+    else:
+        make_session = lambda: TestClientSession(app)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'inference_engine': appmod.INFERENCE_ENGINE,
+            'async_scoring': app.config.get('ASYNC_SCORING', False),
+            'args': vars(args),
+        },
+        'routes': {},
+    }
+    try:
+        for route, (setup, call) in scenarios(seeded).items():
+            if route not in routes:
+                continue
+            latencies, statuses, wall = run_route(
+                make_session, setup, call, args.requests, args.warmup, args.concurrency
+            )
+            results['routes'][route] = summarize(latencies, statuses, wall)
+            print(f"{route}: done")
+        with app.app_context():
+            results['inference'] = benchmark_inference(appmod, args, rng)
+    finally:
+        if server:
+            server.shutdown()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.keep:
+        print(f"Kept {workdir}")
+    else:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the document types we accept, mapped to (mimetype, extension)
+SIGNATURES = (
+    (b'%PDF-', ('application/pdf', 'pdf')),
+    (b'\x89PNG\r\n\x1a\n', ('image/png', 'png')),
+    (b'\xff\xd8\xff', ('image/jpeg', 'jpg')),
+    (b'GIF87a', ('image/gif', 'gif')),
+    (b'GIF89a', ('image/gif', 'gif')),
+)
+
+
+class BlobStore:
+    """Content-addressed document store on the local filesystem.
+
+    Each blob lives at <root>/<h[0:2]>/<h[2:4]>/<h> where h is the SHA-256 of its
+    content, so identical uploads are stored once and rows only need to keep h.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return bool(digest) and os.path.exists(self.path_for(digest))
+
+    def put_stream(self, stream, chunk_size=CHUNK_SIZE):
+        """Copy stream into the store chunk by chunk. Returns (sha256 hex digest, size)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            return self._commit(tmp_path, digest.hexdigest()), size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.exists(digest):
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            self._commit(tmp_path, digest)
+        return digest, len(data)
+
+    def open(self, digest):
+        return open(self.path_for(digest), 'rb')
+
+    def sniff(self, digest):
+        """Detect a stored document's real type from its first bytes. Returns (mimetype, extension)."""
+        with self.open(digest) as f:
+            head = f.read(16)
+        for signature, kind in SIGNATURES:
+            if head.startswith(signature):
+                return kind
+        return 'application/octet-stream', 'bin'
+
+    def _commit(self, tmp_path, digest):
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Already stored under the same content hash
+            os.unlink(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return digest
@@ -0,0 +1,119 @@
+"""Database settings from the environment.
+
+LOAN_DATABASE_URL picks the backend (default: SQLite in the instance folder). SQLite
+gets a profile tuned for several concurrent workers, applied to every new connection:
+WAL journal (readers no longer wait for an apply_loan commit), synchronous=NORMAL, a
+busy timeout instead of immediate "database is locked" errors, and a memory-mapped
+read path. Any other URL (PostgreSQL, MySQL, ...) gets a connection pool sized by
+LOAN_DB_POOL_SIZE / LOAN_DB_MAX_OVERFLOW, with pre-ping so dropped connections are
+replaced instead of failing a request.
+"""
+import os
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = 'sqlite:///db.sqlite3'
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+def sqlite_pragmas():
+    """PRAGMAs run on every new SQLite connection, in order."""
+    return {
+        'journal_mode': os.environ.get('LOAN_SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('LOAN_SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('LOAN_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('LOAN_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': int(os.environ.get('LOAN_SQLITE_CACHE_SIZE', -64000)),  # Negative means KiB
+        'temp_store': 'MEMORY',
+    }
+
+
+def configure_database(app):
+    """Set the database URI and engine options on app.config. Call before db.init_app(app).
+
+    Returns the name of the active profile: 'sqlite' or 'pooled'.
+    """
+    url = os.environ.get('LOAN_DATABASE_URL', DEFAULT_DATABASE_URL)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+
+    if make_url(url).get_backend_name() == 'sqlite':
+        profile = 'sqlite'
+        options = {
+            # The busy timeout is also set as a PRAGMA; this covers the driver's own locking
+            'connect_args': {'timeout': sqlite_pragmas()['busy_timeout'] / 1000},
+        }
+    else:
+        profile = 'pooled'
+        options = {
+            'pool_size': int(os.environ.get('LOAN_DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('LOAN_DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('LOAN_DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('LOAN_DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': _env_bool('LOAN_DB_POOL_PRE_PING', True),
+        }
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    app.config['DATABASE_PROFILE'] = profile
+    return profile
+
+
+def install_sqlite_pragmas(engine):
+    """Apply sqlite_pragmas() to each connection the engine opens. No-op for other backends."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    in_memory = engine.url.database in (None, '', ':memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if name == 'journal_mode' and in_memory:
+                    continue  # In-memory databases cannot use WAL
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def database_report(engine):
+    """What the engine is actually running with, for the startup check and `flask db-profile`."""
+    pool = engine.pool
+    report = {
+        'profile': 'sqlite' if engine.dialect.name == 'sqlite' else 'pooled',
+        'backend': engine.dialect.name,
+        'driver': engine.dialect.driver,
+        'url': engine.url.render_as_string(hide_password=True),
+        'pool': type(pool).__name__,
+    }
+    if hasattr(pool, 'size'):
+        report['pool_size'] = pool.size()
+    if hasattr(pool, '_max_overflow'):
+        report['max_overflow'] = pool._max_overflow
+    report['pool_pre_ping'] = bool(getattr(pool, '_pre_ping', False))
+
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            report['pragmas'] = {
+                name: conn.execute(text(f'PRAGMA {name}')).scalar() for name in sqlite_pragmas()
+            }
+    return report
+
+
+def check_database(engine, log):
+    """Log the active profile, and warn where SQLite did not accept the tuned settings."""
+    report = database_report(engine)
+    log.info("database profile", extra=report)
+
+    pragmas = report.get('pragmas')
+    wanted = sqlite_pragmas()['journal_mode'].lower()
+    if pragmas and engine.url.database not in (None, '', ':memory:') and str(pragmas['journal_mode']).lower() != wanted:
+        # e.g. a network filesystem, where SQLite refuses WAL
+        log.warning("sqlite journal mode not applied",
+                    extra={'wanted': wanted, 'actual': pragmas['journal_mode']})
+    return report
@@ -0,0 +1,49 @@
+try:
+    from PIL import Image
+except ImportError:  # Perceptual matching is optional; exact SHA-256 matching always works
+    Image = None
+
+PHASH_SIZE = 8
+
+
+def perceptual_hash(stream):
+    """64-bit difference hash of an image as 16 hex chars, or None if it can't be computed.
+
+    The image is reduced to a 9x8 greyscale thumbnail and each bit records whether a
+    pixel is brighter than its right neighbour, so re-encoding, rescaling or small
+    compression changes leave most bits intact. PDFs and other non-images return None.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(stream) as image:
+            pixels = list(image.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE)).getdata())
+    except Exception:
+        return None
+    finally:
+        stream.seek(0)
+
+    bits = 0
+    for row in range(PHASH_SIZE):
+        for col in range(PHASH_SIZE):
+            left = pixels[row * (PHASH_SIZE + 1) + col]
+            right = pixels[row * (PHASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def hamming_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def document_matches(sha256, phash, stored_sha256, stored_phash, mode='exact', max_distance=6):
+    """Check an upload's hashes against a verified document's stored hashes.
+
+    'exact' requires identical SHA-256. 'perceptual' also accepts images whose
+    perceptual hashes are within max_distance bits, e.g. a re-scan of the same card.
+    """
+    if sha256 and sha256 == stored_sha256:
+        return True
+    if mode == 'perceptual' and phash and stored_phash:
+        return hamming_distance(phash, stored_phash) <= max_distance
+    return False
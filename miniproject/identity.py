@@ -0,0 +1,51 @@
+"""Who the logged-in user is, without a User SELECT on every request.
+
+login stores the user's id, email, role and active flag in the (signed) session. On
+each request the id is resolved through an in-process TTL/LRU cache of UserRecords,
+so the database is only hit on a miss. delete_user, deactivate_user and activate_user
+drop the user's entry, so a deactivation takes effect on this process's next request
+(and on other processes within the cache TTL).
+"""
+from collections import namedtuple
+
+from models import db, User, Role
+
+# What routes and templates need from a user; immutable, so safe to share from the cache
+UserRecord = namedtuple('UserRecord', 'id name email role active created_at')
+
+
+def load_user_record(user_id=None, email=None):
+    """UserRecord for a user id (or email), read in one query with the role name; None if missing."""
+    query = db.session.query(User.id, User.name, User.email, Role.name, User.flag, User.created_at) \
+        .outerjoin(Role, Role.id == User.role_id)
+    row = query.filter(User.id == user_id).first() if user_id is not None else \
+        query.filter(User.email == email).first()
+    if row is None:
+        return None
+    id_, name, email, role, flag, created_at = row
+    # User.flag is set when an admin deactivates the account
+    return UserRecord(id_, name, email, role or 'customer', not flag, created_at)
+
+
+def record_for(user):
+    """UserRecord for a User instance that is already loaded (e.g. by login)."""
+    return UserRecord(user.id, user.name, user.email, user.role.name if user.role else 'customer',
+                      not user.flag, user.created_at)
+
+
+def get_user_record(user_id, cache):
+    record = cache.get(user_id)
+    if record is None:
+        record = load_user_record(user_id)
+        if record is not None:
+            cache.set(user_id, record)
+    return record
+
+
+def remember_login(session, record):
+    """Start a fresh session for record. Existing keys (role, user_email) are kept for older checks."""
+    session.clear()
+    session['user_id'] = record.id
+    session['user_email'] = record.email
+    session['role'] = record.role
+    session['active'] = record.active
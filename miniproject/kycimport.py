@@ -0,0 +1,414 @@
+"""Bulk import of KYC records into the VerifiedUser registry.
+
+The manifest is a CSV (with a header) or JSON Lines file, one record per row:
+
+    email, income, credit_score, employment_status, aadhaar_number,
+    [status], [aadhaar_file], [pan_file], [income_certificate_file]
+
+Document columns name files relative to the documents directory; they are streamed
+into the blob store. Rows are read one at a time and upserted batch_size at a time
+with INSERT ... ON CONFLICT (email) DO UPDATE, so memory stays flat however large the
+manifest is. Existing records keep documents (and status) the manifest leaves blank.
+
+After every committed batch a checkpoint (the last row number) is written next to
+the manifest, so an interrupted import picks up where it stopped when run again. Rows
+that cannot be imported are written, with the reason, to an errors CSV. A lock file
+is held while a manifest is imported, so any process can tell whether it is still
+running and a second run of the same manifest is refused.
+
+Uploaded manifests are stored under their SHA-256 (store_manifest), so uploading the
+same file again resumes its import instead of starting a new one.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows: running imports are then not detected across processes
+    fcntl = None
+
+from sqlalchemy import case
+
+from models import db, VerifiedUser, DOCUMENT_FIELDS
+from docverify import perceptual_hash
+
+DEFAULT_BATCH_SIZE = 1000
+EMPLOYMENT_STATUSES = ('Employed', 'Self-Employed', 'Unemployed')
+TRUE_VALUES = ('1', 'true', 'yes', 'approved')
+FALSE_VALUES = ('0', 'false', 'no', 'rejected')
+
+# Columns an imported row always sets; documents and status are only set when given
+RECORD_COLUMNS = ('correct_income', 'correct_credit_score', 'employment_status', 'aadhaar_number')
+# A document's hash, size and perceptual hash are always replaced together
+DOCUMENT_GROUPS = {field: tuple(f'{field}_{suffix}' for suffix in ('sha256', 'size', 'phash')) for field in DOCUMENT_FIELDS}
+DOCUMENT_COLUMNS = tuple(name for columns in DOCUMENT_GROUPS.values() for name in columns)
+
+
+MANIFEST_EXTENSIONS = ('csv', 'jsonl', 'ndjson')
+
+
+class KycImportError(Exception):
+    """The import as a whole cannot run (unreadable manifest, checkpoint for a different file, ...)."""
+
+
+class RowError(ValueError):
+    """One manifest row is invalid; it is reported and skipped."""
+
+
+#----------------------------------------------------------------READING----------------------------------------------------------------
+def read_manifest(path):
+    """Yield (row number, dict) for each record in a .csv or .jsonl manifest, streaming."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield number, RowError(f"invalid JSON: {e}")
+                    continue
+                yield number, record if isinstance(record, dict) else RowError("not a JSON object")
+        else:
+            for number, record in enumerate(csv.DictReader(f), 1):
+                yield number, record
+
+
+def _field(record, *names):
+    for name in names:
+        value = record.get(name)
+        if value is not None and str(value).strip() != '':
+            return str(value).strip()
+    return None
+
+
+def parse_record(record):
+    """Validate a manifest record. Returns (column values, {document field: file name})."""
+    email = _field(record, 'email')
+    if not email or '@' not in email:
+        raise RowError("missing or invalid email")
+
+    try:
+        income = float(_field(record, 'income', 'correct_income'))
+        credit_score = int(float(_field(record, 'credit_score', 'correct_credit_score')))
+    except (TypeError, ValueError):
+        raise RowError("income and credit_score must be numbers")
+    if income < 0:
+        raise RowError("income must not be negative")
+
+    employment_status = _field(record, 'employment_status')
+    if employment_status not in EMPLOYMENT_STATUSES:
+        raise RowError(f"employment_status must be one of {', '.join(EMPLOYMENT_STATUSES)}")
+
+    aadhaar_number = (_field(record, 'aadhaar_number') or '').replace(' ', '')
+    if not aadhaar_number.isdigit():
+        raise RowError("aadhaar_number must be digits")
+
+    values = {
+        'email': email,
+        'correct_income': income,
+        'correct_credit_score': credit_score,
+        'employment_status': employment_status,
+        'aadhaar_number': int(aadhaar_number),
+    }
+
+    status = _field(record, 'status')
+    if status is not None:
+        if status.lower() not in TRUE_VALUES + FALSE_VALUES:
+            raise RowError("status must be true/false or Approved/Rejected")
+        values['status'] = status.lower() in TRUE_VALUES
+
+    documents = {field: _field(record, field) for field in DOCUMENT_FIELDS if _field(record, field)}
+    return values, documents
+
+
+#----------------------------------------------------------------DOCUMENTS----------------------------------------------------------------
+def store_documents(documents, documents_dir, store, allowed_file, max_size):
+    """Stream each named document into store. Returns the <field>_sha256/_size/_phash values.
+
+    The perceptual hash is always stored, as by manage_verified_users, so imported records
+    match once DOCUMENT_MATCH_MODE is switched to 'perceptual'; it is None for non-images.
+    """
+    root = os.path.realpath(documents_dir)
+    columns = {}
+    for field, name in documents.items():
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root:
+            raise RowError(f"{field}: {name} is outside the documents directory")
+        if not allowed_file(name):
+            raise RowError(f"{field}: {name} is not an allowed document type")
+        if not os.path.isfile(path):
+            raise RowError(f"{field}: {name} not found")
+        size = os.path.getsize(path)
+        if max_size and size > max_size:
+            raise RowError(f"{field}: {name} is larger than {max_size} bytes")
+
+        with open(path, 'rb') as f:
+            digest, size = store.put_stream(f)
+            f.seek(0)
+            phash = perceptual_hash(f)
+        columns[f'{field}_sha256'] = digest
+        columns[f'{field}_size'] = size
+        columns[f'{field}_phash'] = phash
+    return columns
+
+
+#----------------------------------------------------------------WRITING----------------------------------------------------------------
+def upsert_statement(dialect_name, update_status):
+    """INSERT ... ON CONFLICT (email) DO UPDATE for SQLite/PostgreSQL, or None for other backends."""
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+
+    table = VerifiedUser.__table__
+    statement = insert(table)
+    excluded = statement.excluded
+    updates = {name: excluded[name] for name in RECORD_COLUMNS}
+    # A blank document column keeps the stored document; a new one replaces all three of its columns
+    for field, columns in DOCUMENT_GROUPS.items():
+        replaced = excluded[f'{field}_sha256'].isnot(None)
+        updates.update({name: case((replaced, excluded[name]), else_=table.c[name]) for name in columns})
+    if update_status:
+        updates['status'] = excluded.status
+    updates['updated_at'] = excluded.updated_at
+    return statement.on_conflict_do_update(index_elements=[table.c.email], set_=updates)
+
+
+def _merge(previous, values):
+    """A later row for the same email over an earlier one, documents replaced a whole field at a time."""
+    merged = {**previous, **{k: v for k, v in values.items() if v is not None and k not in DOCUMENT_COLUMNS}}
+    for field, columns in DOCUMENT_GROUPS.items():
+        if values.get(f'{field}_sha256') is not None:
+            merged.update({name: values.get(name) for name in columns})
+    return merged
+
+
+def write_batch(rows):
+    """Upsert parsed rows in one transaction, one executemany per statement shape.
+
+    Returns the number of records written: rows for the same email count once.
+    """
+    dialect_name = db.engine.dialect.name
+    now = datetime.utcnow()
+
+    # One row per email (the last one wins), since a statement may not update a row twice
+    latest = {}
+    for values in rows:
+        previous = latest.pop(values['email'], None)
+        if previous:
+            values = _merge(previous, values)
+        latest[values['email']] = values
+
+    with_status, without_status = [], []
+    for values in latest.values():
+        row = {
+            **dict.fromkeys(DOCUMENT_COLUMNS),
+            **values,
+            'bank_count': 1,
+            'flag': True,
+            'updated_at': now,
+        }
+        if 'status' in values:
+            with_status.append(row)
+        else:
+            row['status'] = True  # New records start approved; existing ones keep theirs
+            without_status.append(row)
+
+    for group, update_status in ((with_status, True), (without_status, False)):
+        if not group:
+            continue
+        statement = upsert_statement(dialect_name, update_status)
+        if statement is not None:
+            db.session.execute(statement, group)
+            continue
+        # Other backends: look each record up and merge it (slower, same result)
+        for row in group:
+            existing = VerifiedUser.query.filter_by(email=row['email']).first()
+            if existing is None:
+                db.session.add(VerifiedUser(**row))
+                continue
+            for name in RECORD_COLUMNS + ('updated_at',):
+                setattr(existing, name, row[name])
+            for field, columns in DOCUMENT_GROUPS.items():
+                if row[f'{field}_sha256'] is not None:
+                    for name in columns:
+                        setattr(existing, name, row[name])
+            if update_status:
+                existing.status = row['status']
+    db.session.commit()
+    return len(latest)
+
+
+#----------------------------------------------------------------CHECKPOINTS----------------------------------------------------------------
+def checkpoint_path(manifest):
+    return manifest + '.checkpoint'
+
+
+def errors_path(manifest):
+    return manifest + '.errors.csv'
+
+
+def read_checkpoint(manifest):
+    try:
+        with open(checkpoint_path(manifest)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(manifest, state):
+    path = checkpoint_path(manifest)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def lock_path(manifest):
+    return manifest + '.lock'
+
+
+@contextmanager
+def import_lock(manifest):
+    """Held while manifest is imported; raises KycImportError if another run holds it."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path(manifest), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise KycImportError(f"{manifest} is already being imported")
+        yield  # Released when the file is closed, including when the process dies
+
+
+def import_running(manifest):
+    """Whether some process is importing manifest right now (None where that cannot be told)."""
+    if fcntl is None:
+        return None
+    if not os.path.exists(lock_path(manifest)):
+        return False
+    with open(lock_path(manifest), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+    return False
+
+
+#----------------------------------------------------------------UPLOADED MANIFESTS----------------------------------------------------------------
+def store_manifest(stream, directory, extension):
+    """Save an uploaded manifest as <sha256>.<extension> in directory. Returns (sha256, path).
+
+    The same content always lands on the same path, and so on the same checkpoint.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False) as f:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    path = os.path.join(directory, f'{digest.hexdigest()}.{extension}')
+    if os.path.exists(path):
+        os.unlink(f.name)
+    else:
+        os.replace(f.name, path)
+    return digest.hexdigest(), path
+
+
+def find_manifest(directory, digest):
+    """Path of the uploaded manifest with this SHA-256, or None."""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        return None
+    for extension in MANIFEST_EXTENSIONS:
+        path = os.path.join(directory, f'{digest}.{extension}')
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+#----------------------------------------------------------------IMPORT----------------------------------------------------------------
+def import_verified_users(manifest, documents_dir, store, allowed_file, max_size=None,
+                          batch_size=DEFAULT_BATCH_SIZE, restart=False, log=print):
+    """Import a manifest into VerifiedUser, resuming from its checkpoint. Returns the final state dict.
+
+    Raises KycImportError if the manifest is already being imported.
+    """
+    if not os.path.isfile(manifest):
+        raise KycImportError(f"Manifest not found: {manifest}")
+    with import_lock(manifest):
+        return _import_verified_users(manifest, documents_dir, store, allowed_file, max_size, batch_size, restart, log)
+
+
+def _import_verified_users(manifest, documents_dir, store, allowed_file, max_size, batch_size, restart, log):
+    manifest_size = os.path.getsize(manifest)
+
+    state = None if restart else read_checkpoint(manifest)
+    if state and state.get('manifest_size') != manifest_size:
+        raise KycImportError(
+            f"{manifest} changed since its checkpoint was written; rerun with restart to import it from the start"
+        )
+    if state and state.get('done'):
+        log(f"{manifest}: already imported ({state['imported']} rows, {state['failed']} errors)")
+        return state
+    if state:
+        log(f"{manifest}: resuming after row {state['row']}")
+    else:
+        state = {'manifest_size': manifest_size, 'row': 0, 'imported': 0, 'failed': 0, 'done': False}
+        if os.path.exists(errors_path(manifest)):
+            os.unlink(errors_path(manifest))
+
+    started = time.perf_counter()
+    imported_before = state['imported']
+    resume_after = state['row']
+    batch, last_row = [], resume_after
+    errors_file = open(errors_path(manifest), 'a', newline='', encoding='utf-8')
+    errors = csv.writer(errors_file)
+
+    def flush():
+        if batch:
+            state['imported'] += write_batch(batch)
+        state['row'] = last_row
+        write_checkpoint(manifest, state)
+        errors_file.flush()
+        rate = (state['imported'] - imported_before) / max(time.perf_counter() - started, 1e-9)
+        log(f"{manifest}: {state['row']} rows read, {state['imported']} imported, "
+            f"{state['failed']} errors ({rate:.0f} rows/s)")
+        batch.clear()
+
+    try:
+        for number, record in read_manifest(manifest):
+            if number <= resume_after:
+                continue
+            last_row = number
+            try:
+                if isinstance(record, RowError):
+                    raise record
+                values, documents = parse_record(record)
+                values.update(store_documents(documents, documents_dir, store, allowed_file, max_size))
+            except RowError as e:
+                state['failed'] += 1
+                errors.writerow([number, record.get('email') if isinstance(record, dict) else '', str(e)])
+                continue
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        state['done'] = True
+        write_checkpoint(manifest, state)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        errors_file.close()
+    return state
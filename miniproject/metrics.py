@@ -0,0 +1,222 @@
+"""In-process request, database and model metrics in the Prometheus text format.
+
+setup_metrics() times every request per endpoint and counts the SQL statements it
+runs (SQLAlchemy cursor events), so an N+1 regression shows up as a jump in
+loan_http_request_db_queries and a "query budget exceeded" log line. Model inference
+and document bytes are recorded by the code that does them. Everything is served on
+/metrics and, with LOAN_SERVER_TIMING on, as a Server-Timing header per response.
+
+Metrics are per process: scrape every worker (or run a single one) to get totals.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from applog import log
+
+# Seconds; tuned for a web app whose fast paths take a few ms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+INFERENCE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # key -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", le)])} {cumulative}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'loan_http_request_duration_seconds', 'Time spent handling a request.',
+    LATENCY_BUCKETS, ('endpoint', 'method', 'status'))
+REQUEST_DB_QUERIES = Histogram(
+    'loan_http_request_db_queries', 'SQL statements executed per request.',
+    QUERY_COUNT_BUCKETS, ('endpoint',))
+REQUEST_DB_DURATION = Histogram(
+    'loan_http_request_db_seconds', 'Time spent in SQL statements per request.',
+    LATENCY_BUCKETS, ('endpoint',))
+QUERY_BUDGET_EXCEEDED = Counter(
+    'loan_http_query_budget_exceeded_total', 'Requests that ran more SQL statements than LOAN_QUERY_BUDGET.',
+    ('endpoint',))
+INFERENCE_DURATION = Histogram(
+    'loan_model_inference_seconds', 'Time spent in model predict calls.',
+    INFERENCE_BUCKETS, ('engine', 'kind'))
+INFERENCE_ROWS = Counter(
+    'loan_model_inference_rows_total', 'Applications scored by the model.', ('engine', 'kind'))
+BLOB_BYTES = Counter(
+    'loan_blob_bytes_total', 'KYC document bytes written to or served from the blob store.', ('direction',))
+SHADOW_COMPARISONS = Counter(
+    'loan_shadow_comparisons_total', 'Applications sent to a shadow model version, by outcome.', ('outcome',))
+
+METRICS = (
+    REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION, QUERY_BUDGET_EXCEEDED,
+    INFERENCE_DURATION, INFERENCE_ROWS, BLOB_BYTES, SHADOW_COMPARISONS,
+)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def inference_timer(engine, kind, rows=1):
+    """Time a model predict call; the time also goes into the request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        INFERENCE_DURATION.observe(elapsed, engine=engine, kind=kind)
+        INFERENCE_ROWS.inc(rows, engine=engine, kind=kind)
+        if has_request_context():
+            g.model_seconds = g.get('model_seconds', 0.0) + elapsed
+
+
+def count_blob_bytes(direction, size):
+    if size:
+        BLOB_BYTES.inc(size, direction=direction)
+
+
+def instrument_engine(engine):
+    """Count and time every SQL statement run on engine during a request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_seconds = g.get('db_seconds', 0.0) + (time.perf_counter() - started)
+
+
+def setup_metrics(app, db):
+    """Register the request hooks, the SQL listeners and the /metrics endpoint.
+
+    Configured by LOAN_SERVER_TIMING (add the header), LOAN_QUERY_BUDGET (SQL statements
+    a request may run before it is logged, default 20) and LOAN_METRICS_TOKEN (if set,
+    /metrics requires "Authorization: Bearer <token>").
+    """
+    app.config['SERVER_TIMING'] = os.environ.get('LOAN_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+    app.config['QUERY_BUDGET'] = int(os.environ.get('LOAN_QUERY_BUDGET', 20))
+    app.config['METRICS_TOKEN'] = os.environ.get('LOAN_METRICS_TOKEN')
+
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        # The route pattern, not the URL, so /download/<email>/... does not make one series per user
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        queries = g.get('db_queries', 0)
+        db_seconds = g.get('db_seconds', 0.0)
+
+        REQUEST_DURATION.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.observe(queries, endpoint=endpoint)
+        REQUEST_DB_DURATION.observe(db_seconds, endpoint=endpoint)
+        if queries > app.config['QUERY_BUDGET']:
+            QUERY_BUDGET_EXCEEDED.inc(endpoint=endpoint)
+            log.warning("query budget exceeded", extra={
+                'endpoint': endpoint, 'queries': queries, 'budget': app.config['QUERY_BUDGET'],
+            })
+
+        if app.config['SERVER_TIMING']:
+            timings = [
+                f'app;dur={elapsed * 1000:.2f}',
+                f'db;dur={db_seconds * 1000:.2f};desc="{queries} queries"',
+            ]
+            if 'model_seconds' in g:
+                timings.append(f'model;dur={g.model_seconds * 1000:.3f}')
+            response.headers.add('Server-Timing', ', '.join(timings))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response("Access Denied!\n", status=403, mimetype='text/plain')
+        return Response(render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
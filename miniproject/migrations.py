@@ -0,0 +1,106 @@
+"""Lightweight schema and data migrations for the app's database.
+
+db.create_all() only creates missing tables, so upgrade_schema() fills in columns
+and indexes that were added to existing models afterwards, and widens string columns
+whose model length has grown. Data migrations are run
+on demand through the Flask CLI (see the commands registered in app.py).
+"""
+import io
+
+from sqlalchemy import inspect, text
+
+from models import db, DOCUMENT_FIELDS
+from docverify import perceptual_hash
+
+# Tables that used to keep documents in LargeBinary columns named after DOCUMENT_FIELDS
+BLOB_TABLES = ('loan_application', 'verified_user')
+
+
+def upgrade_schema():
+    """Add any model column or index missing from an existing table. Safe to run at every startup."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c['name']: c for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    _widen_column(conn, table, column, existing[column.name]['type'])
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+
+
+def _widen_column(conn, table, column, current_type):
+    """Grow a VARCHAR column to its model length. SQLite does not enforce lengths, so it is left alone."""
+    length = getattr(column.type, 'length', None)
+    current_length = getattr(current_type, 'length', None)
+    if not length or not current_length or current_length >= length:
+        return
+    dialect = conn.dialect.name
+    column_type = column.type.compile(dialect=conn.dialect)
+    if dialect == 'postgresql':
+        conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE {column_type}'))
+    elif dialect in ('mysql', 'mariadb'):
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        conn.execute(text(f'ALTER TABLE {table.name} MODIFY {column.name} {column_type} {null}'))
+
+
+def migrate_blobs(store, batch_size=100, drop_columns=False, log=print):
+    """Move documents from the legacy LargeBinary columns into store.
+
+    Rows are processed batch_size at a time and each batch is committed, so an
+    interrupted run can simply be restarted. VerifiedUser documents also get their
+    perceptual hash, for DOCUMENT_MATCH_MODE = 'perceptual'. Returns the number of
+    documents moved.
+    """
+    upgrade_schema()
+    inspector = inspect(db.engine)
+    moved = 0
+    for table in BLOB_TABLES:
+        if table not in inspector.get_table_names():
+            continue
+        legacy = [f for f in DOCUMENT_FIELDS if f in {c['name'] for c in inspector.get_columns(table)}]
+        if not legacy:
+            continue
+
+        pending = ' OR '.join(f'{f} IS NOT NULL' for f in legacy)
+        while True:
+            with db.engine.begin() as conn:
+                rows = conn.execute(
+                    text(f'SELECT id, {", ".join(legacy)} FROM {table} WHERE {pending} LIMIT :n'),
+                    {'n': batch_size}
+                ).fetchall()
+                for row in rows:
+                    updates = {}
+                    for field, data in zip(legacy, row[1:]):
+                        if data is None:
+                            continue
+                        digest, size = store.put_bytes(bytes(data))
+                        updates[f'{field}_sha256'] = digest
+                        updates[f'{field}_size'] = size
+                        if table == 'verified_user':
+                            updates[f'{field}_phash'] = perceptual_hash(io.BytesIO(bytes(data)))
+                        updates[field] = None
+                        moved += 1
+                    assignments = ', '.join(f'{name} = :{name}' for name in updates)
+                    conn.execute(text(f'UPDATE {table} SET {assignments} WHERE id = :id'), {**updates, 'id': row[0]})
+            if not rows:
+                break
+            log(f"{table}: moved {moved} documents so far")
+
+        if drop_columns:
+            # Needs SQLite 3.35+; run VACUUM afterwards to give the space back to the filesystem
+            with db.engine.begin() as conn:
+                for field in legacy:
+                    conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {field}'))
+            log(f"{table}: dropped legacy columns {', '.join(legacy)}")
+
+    return moved
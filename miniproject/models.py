@@ -3,6 +3,9 @@ from datetime import datetime
 
 db = SQLAlchemy()
 
+# Uploaded KYC documents; each is kept in the blob store and referenced by <name>_sha256 / <name>_size
+DOCUMENT_FIELDS = ('aadhaar_file', 'pan_file', 'income_certificate_file')
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -37,23 +40,85 @@ class LoanApplication(db.Model):
     
     flag = db.Column(db.Boolean, default=True)  
     aadhaar_number = db.Column(db.BigInteger, nullable=False)
-
-    # Uploaded documents
-    aadhaar_file = db.Column(db.LargeBinary, nullable=True)
-    pan_file = db.Column(db.LargeBinary, nullable=True)
-    income_certificate_file = db.Column(db.LargeBinary, nullable=True)
+    model_version = db.Column(db.String(64), nullable=True)  # Registry version that scored it (see registry.py)
+
+    # Uploaded documents (content lives in the blob store, keyed by SHA-256)
+    aadhaar_file_sha256 = db.Column(db.String(64), nullable=True)
+    aadhaar_file_size = db.Column(db.Integer, nullable=True)
+    pan_file_sha256 = db.Column(db.String(64), nullable=True)
+    pan_file_size = db.Column(db.Integer, nullable=True)
+    income_certificate_file_sha256 = db.Column(db.String(64), nullable=True)
+    income_certificate_file_size = db.Column(db.Integer, nullable=True)
+
+    # Async scoring queue (see scoring.py): queued_at is set while the application waits
+    # for a worker, claimed_by/claimed_at while a worker is scoring it
+    scoring_queued_at = db.Column(db.DateTime, nullable=True)
+    scoring_claimed_by = db.Column(db.String(32), nullable=True)
+    scoring_claimed_at = db.Column(db.DateTime, nullable=True)
 
     user = db.relationship('User', backref='loan_applications')
 
     def __repr__(self):
         return f'<LoanApplication {self.id} - User {self.user_id}>'
 
+# Dashboard history (user_id filter, newest first), admin status filter and listing sorts, Aadhaar lookups,
+# the scoring worker's queue scan and the analytics export's watermark scan.
+# User.email, VerifiedUser.email and Customer.user_id are already indexed by their unique constraints.
+db.Index('ix_loan_application_user_id_created_at', LoanApplication.user_id, LoanApplication.created_at.desc())
+db.Index('ix_loan_application_prediction_created_at', LoanApplication.prediction, LoanApplication.created_at)
+db.Index('ix_loan_application_created_at', LoanApplication.created_at)
+db.Index('ix_loan_application_loan_amount', LoanApplication.loan_amount)
+db.Index('ix_loan_application_aadhaar_number', LoanApplication.aadhaar_number)
+db.Index('ix_loan_application_scoring_queued_at', LoanApplication.scoring_queued_at)
+db.Index('ix_loan_application_updated_at_id', LoanApplication.updated_at, LoanApplication.id)
+
+
+class PortfolioStat(db.Model):
+    """Running totals of loan applications per bucket, maintained by stats.py in the same
+    transaction as each application write. bucket_type is 'all' (bucket ''), 'day'
+    (YYYY-MM-DD of created_at) or 'credit' (credit-score band such as '650-699')."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    bucket_type = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.String(20), nullable=False, default='')
+    prediction = db.Column(db.String(10), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    loan_amount_sum = db.Column(db.Float, nullable=False, default=0)
+    income_sum = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('bucket_type', 'bucket', 'prediction', name='uq_portfolio_stat_bucket'),)
+
+
+class ShadowComparison(db.Model):
+    """One application scored by both the live and a shadow model version (see shadow.py).
+
+    The live version made the decision; candidate_decided is set when that was the
+    candidate, under the A/B split, and the current version ran in the shadow."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    live_version = db.Column(db.String(64), nullable=False)
+    shadow_version = db.Column(db.String(64), nullable=False)
+    candidate_decided = db.Column(db.Boolean, nullable=False, default=False)
+    live_prediction = db.Column(db.String(10), nullable=False)
+    shadow_prediction = db.Column(db.String(10), nullable=False)
+    agree = db.Column(db.Boolean, nullable=False)
+    live_ms = db.Column(db.Float, nullable=False)
+    shadow_ms = db.Column(db.Float, nullable=False)
+    # The feature vector both versions scored (employment_status encoded as for the model)
+    income = db.Column(db.Float, nullable=False)
+    credit_score = db.Column(db.Integer, nullable=False)
+    loan_amount = db.Column(db.Float, nullable=False)
+    employment_status = db.Column(db.Integer, nullable=False)
+
+# shadow-report: one pair of versions over a time window
+db.Index('ix_shadow_comparison_versions_created_at',
+         ShadowComparison.live_version, ShadowComparison.shadow_version, ShadowComparison.created_at)
+
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
     address = db.Column(db.String(255), nullable=False)
-    payment_mode = db.Column(db.String(50), nullable=False)
+    payment_mode = db.Column(db.String(255), nullable=False)  # Latest suggestion, as long as rejection_suggestion
     phone_number = db.Column(db.String(15), nullable=False)
 
 
@@ -71,10 +136,17 @@ class VerifiedUser(db.Model):  # Acts as a centralized RBI-like database
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     flag = db.Column(db.Boolean, default=True)
 
-    # Uploaded documents (for cross-checking with user dashboard)
-    aadhaar_file = db.Column(db.LargeBinary, nullable=True)
-    pan_file = db.Column(db.LargeBinary, nullable=True)
-    income_certificate_file = db.Column(db.LargeBinary, nullable=True)
+    # Uploaded documents (for cross-checking with user dashboard), stored like LoanApplication's
+    aadhaar_file_sha256 = db.Column(db.String(64), nullable=True)
+    aadhaar_file_size = db.Column(db.Integer, nullable=True)
+    pan_file_sha256 = db.Column(db.String(64), nullable=True)
+    pan_file_size = db.Column(db.Integer, nullable=True)
+    income_certificate_file_sha256 = db.Column(db.String(64), nullable=True)
+    income_certificate_file_size = db.Column(db.Integer, nullable=True)
+    # Perceptual hashes of image documents, for DOCUMENT_MATCH_MODE = 'perceptual'
+    aadhaar_file_phash = db.Column(db.String(16), nullable=True)
+    pan_file_phash = db.Column(db.String(16), nullable=True)
+    income_certificate_file_phash = db.Column(db.String(16), nullable=True)
 
     aadhaar_number = db.Column(db.BigInteger, nullable=False)
 
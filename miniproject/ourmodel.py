@@ -1,69 +1,90 @@
-import pandas as pd
-import numpy as np
+import argparse
+import os
 import pickle
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+
+import numpy as np
+
+FEATURES = ['income', 'credit_score', 'loan_amount', 'employment_status']
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get('LOAN_MODEL_PATH', os.path.join(BASE_DIR, 'loan_model.pkl'))
+# Memory-mappable export of MODEL_PATH used by the flat engine (see artifact.py)
+ARTIFACT_PATH = os.environ.get('LOAN_MODEL_ARTIFACT', os.path.join(BASE_DIR, 'loan_model.flat'))
 
 # Data Generation (Original)
-np.random.seed(42)
-num_samples = 1000
-data = pd.DataFrame({
-    'income': np.random.randint(20000, 90000, num_samples),
-    'credit_score': np.random.randint(300, 850, num_samples),
-    'loan_amount': np.random.randint(5000, 80000, num_samples),
-    'employment_status': np.random.choice([0, 1], num_samples),
-})
-data['approved'] = np.where(
-    (data['income'] > data['loan_amount'] * 1.2) & 
-    (data['credit_score'] > 500) & 
-    (data['employment_status'] == 1),
-    1, 0
-)
+def generate_data(num_samples=1000, seed=42):
+    import pandas as pd
+
+    np.random.seed(seed)
+    data = pd.DataFrame({
+        'income': np.random.randint(20000, 90000, num_samples),
+        'credit_score': np.random.randint(300, 850, num_samples),
+        'loan_amount': np.random.randint(5000, 80000, num_samples),
+        'employment_status': np.random.choice([0, 1], num_samples),
+    })
+    data['approved'] = np.where(
+        (data['income'] > data['loan_amount'] * 1.2) &
+        (data['credit_score'] > 500) &
+        (data['employment_status'] == 1),
+        1, 0
+    )
+    return data
 
 # Model Training (Original)
-X = data[['income', 'credit_score', 'loan_amount', 'employment_status']]
-y = data['approved']
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-model = RandomForestClassifier(n_estimators=200, max_depth=10, random_state=42, class_weight="balanced")
-model.fit(X_train, y_train)
+def train_model(data):
+    from sklearn.model_selection import train_test_split
+    from sklearn.ensemble import RandomForestClassifier
+
+    X = data[FEATURES]
+    y = data['approved']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = RandomForestClassifier(n_estimators=200, max_depth=10, random_state=42, class_weight="balanced")
+    model.fit(X_train, y_train)
+    return model
+
+def save_model(model, path=MODEL_PATH):
+    with open(path, 'wb') as f:
+        pickle.dump(model, f)
+
+#----------------------------------------------------------MODEL ACCESS----------------------------------------------------------
+def active_model():
+    """The ModelVersion this process is serving, from the registry (see registry.py)."""
+    from registry import active_models
+
+    return active_models().get()
+
+def get_model():
+    """Return the RandomForestClassifier of the active model version."""
+    return active_model().sklearn()
+
+def get_flat_model():
+    """Return the flattened form of the active model version (memory-mapped from its artifact)."""
+    return active_model().flat()
+
+def export_artifact(model, path=ARTIFACT_PATH, source=MODEL_PATH, metadata=None):
+    from artifact import save_artifact
+
+    return save_artifact(model, path, FEATURES, source=source, metadata=metadata)
 
 # Enhanced Decision System
 def loan_decision(applicant):
     """Returns approval status with personalized recommendations"""
+    import pandas as pd
+
     # Convert to DataFrame for model prediction
-    applicant_df = pd.DataFrame([applicant])
-    
+    applicant_df = pd.DataFrame([applicant])[FEATURES]
+
     # Get model prediction
-    prediction = model.predict(applicant_df)[0]
-    
+    prediction = get_model().predict(applicant_df)[0]
+
     if prediction == 1:
         return "✅ APPROVED"
-    
-    # Rejection analysis
-    reasons = []
-    suggestions = []
-    
-    # Employment check
-    if applicant['employment_status'] == 0:
-        reasons.append("unemployed")
-        suggestions.append("Only employed applicants qualify")
-    
-    # Credit score check
-    if applicant['credit_score'] <= 500:
-        reasons.append(f"credit score ({applicant['credit_score']}) ≤ 500")
-        suggestions.append(f"Increase score to at least 501 (current: {applicant['credit_score']})")
-    
-    # Income-to-loan ratio
-    required_income = applicant['loan_amount'] * 1.2
-    if applicant['income'] <= required_income:
-        reasons.append(f"income (₹{applicant['income']}) too low for ₹{applicant['loan_amount']} loan")
-        max_eligible = int(applicant['income'] / 1.2)
-        suggestions.append(f"Apply for ₹{max_eligible} or less instead")
-    
-    # Format output
-    rejection_msg = "❌ REJECTED: " + ", ".join(reasons).capitalize()
-    suggestion_msg = "💡 Suggestions: " + "; ".join(suggestions)
-    
+
+    # Rejection analysis (same rules as apply_loan, see rules.py)
+    from rules import explain
+
+    rejection_msg, suggestion_msg = explain(
+        applicant['income'], applicant['credit_score'], applicant['loan_amount'], applicant['employment_status']
+    )
     return f"{rejection_msg}\n{suggestion_msg}"
 
 # Test Cases with Recommendations
@@ -75,14 +96,48 @@ test_applications = [
     {'income': 80000, 'credit_score': 600, 'loan_amount': 70000, 'employment_status': 1},  # Borderline
 ]
 
-print("LOAN DECISION ENGINE\n" + "="*40)
-for app in test_applications:
-    decision = loan_decision(app)
-    print(f"\nApplication: ₹{app['loan_amount']} loan | ₹{app['income']} income | {app['credit_score']} credit")
-    print(decision)
-    print("-"*60)   
+def demo():
+    print("LOAN DECISION ENGINE\n" + "="*40)
+    for app in test_applications:
+        decision = loan_decision(app)
+        print(f"\nApplication: ₹{app['loan_amount']} loan | ₹{app['income']} income | {app['credit_score']} credit")
+        print(decision)
+        print("-"*60)
+
+#----------------------------------------------------------CLI----------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ourmodel', description='Train and inspect the loan model')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train = commands.add_parser('train', help='Train on synthetic data and export the model')
+    train.add_argument('--out', default=MODEL_PATH, help='Where to write the pickled model')
+    train.add_argument('--samples', type=int, default=1000)
+    train.add_argument('--seed', type=int, default=42)
+    train.add_argument('--artifact', default=ARTIFACT_PATH, help='Where to write the memory-mappable artifact')
+
+    export = commands.add_parser('export', help='Export an existing pickled model as a memory-mappable artifact')
+    export.add_argument('--model', default=MODEL_PATH)
+    export.add_argument('--out', default=ARTIFACT_PATH)
+
+    commands.add_parser('demo', help='Print decisions for the built-in test applications')
+
+    args = parser.parse_args(argv)
+    if args.command == 'train':
+        model = train_model(generate_data(args.samples, args.seed))
+        save_model(model, args.out)
+        export_artifact(model, args.artifact, source=args.out)
+        print(f"Model written to {args.out}, artifact to {args.artifact}")
+    elif args.command == 'export':
+        with open(args.model, 'rb') as f:
+            model = pickle.load(f)
+        export_artifact(model, args.out, source=args.model)
+        print(f"Artifact written to {args.out}")
+    elif args.command == 'demo':
+        demo()
+
 
-# ... (keep all your existing ourmodels.py code)
+if __name__ == '__main__':
+    main()
 
 # Add this at the bottom to make the function available for import
-__all__ = ['loan_decision', 'model']
\ No newline at end of file
+__all__ = ['FEATURES', 'MODEL_PATH', 'ARTIFACT_PATH', 'active_model', 'get_model', 'get_flat_model', 'export_artifact', 'loan_decision', 'train_model', 'save_model']
@@ -0,0 +1,158 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload, load_only
+
+from models import db, User, LoanApplication, VerifiedUser, Customer
+from analytics import export_chunk
+
+LOANS_PAGE_SIZE = 50
+
+# sort name -> (column, descending)
+LOAN_SORTS = {
+    'newest': (LoanApplication.created_at, True),
+    'oldest': (LoanApplication.created_at, False),
+    'amount_desc': (LoanApplication.loan_amount, True),
+    'amount_asc': (LoanApplication.loan_amount, False),
+}
+
+# Only what the loans table shows is loaded; everything else on the row stays deferred
+LOAN_LISTING_COLUMNS = (
+    LoanApplication.id,
+    LoanApplication.user_id,
+    LoanApplication.income,
+    LoanApplication.credit_score,
+    LoanApplication.loan_amount,
+    LoanApplication.prediction,
+    LoanApplication.created_at,
+)
+
+
+# What user_dashboard renders for each application
+DASHBOARD_COLUMNS = (
+    LoanApplication.id,
+    LoanApplication.income,
+    LoanApplication.credit_score,
+    LoanApplication.loan_amount,
+    LoanApplication.employment_status,
+    LoanApplication.prediction,
+    LoanApplication.rejection_reason,
+    LoanApplication.rejection_suggestion,
+    LoanApplication.suggestion,
+    LoanApplication.created_at,
+    LoanApplication.scoring_queued_at,
+)
+
+
+def user_applications(user_id):
+    """A user's applications, newest first, as plain rows of DASHBOARD_COLUMNS (safe to cache)."""
+    return (
+        db.session.query(*DASHBOARD_COLUMNS)
+        .filter(LoanApplication.user_id == user_id)
+        .order_by(LoanApplication.created_at.desc(), LoanApplication.id.desc())
+    )
+
+
+def applicant(email):
+    """The user with email joined to their KYC record and customer profile: rows of
+    (User, VerifiedUser or None, Customer or None)."""
+    return (
+        db.session.query(User, VerifiedUser, Customer)
+        .outerjoin(VerifiedUser, VerifiedUser.email == User.email)
+        .outerjoin(Customer, Customer.user_id == User.id)
+        .filter(User.email == email)
+    )
+
+
+def encode_cursor(loan, sort):
+    column, _ = LOAN_SORTS[sort]
+    value = getattr(loan, column.key)
+    value = value.isoformat() if isinstance(value, datetime) else repr(value)
+    return f'{value}|{loan.id}'
+
+
+def decode_cursor(cursor, sort):
+    column, _ = LOAN_SORTS[sort]
+    value, loan_id = cursor.rsplit('|', 1)
+    value = datetime.fromisoformat(value) if column is LoanApplication.created_at else float(value)
+    return value, int(loan_id)
+
+
+def loan_listing(status=None, min_amount=None, max_amount=None, date_from=None, date_to=None,
+                 sort='newest', after=None, limit=LOANS_PAGE_SIZE):
+    """Build the manage_loans query: filtered, keyset-paginated, applicant joined in.
+
+    after is the cursor of the last row of the previous page (see encode_cursor); rows
+    are ordered by the sort column and then id, so pages are stable under inserts.
+    """
+    column, descending = LOAN_SORTS[sort]
+    query = LoanApplication.query.options(
+        load_only(*LOAN_LISTING_COLUMNS),
+        joinedload(LoanApplication.user).load_only(User.id, User.name, User.email),
+    )
+
+    if status:
+        query = query.filter(LoanApplication.prediction == status)
+    if min_amount is not None:
+        query = query.filter(LoanApplication.loan_amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(LoanApplication.loan_amount <= max_amount)
+    if date_from:
+        query = query.filter(LoanApplication.created_at >= date_from)
+    if date_to:
+        query = query.filter(LoanApplication.created_at < date_to)
+
+    if after:
+        value, loan_id = decode_cursor(after, sort)
+        if descending:
+            query = query.filter(db.or_(column < value, db.and_(column == value, LoanApplication.id < loan_id)))
+        else:
+            query = query.filter(db.or_(column > value, db.and_(column == value, LoanApplication.id > loan_id)))
+
+    order = (column.desc(), LoanApplication.id.desc()) if descending else (column.asc(), LoanApplication.id.asc())
+    return query.order_by(*order).limit(limit)
+
+
+#----------------------------------------------------------QUERY PLANS----------------------------------------------------------
+def hot_queries():
+    """A representative instance of each query the routes issue, keyed by where it is used.
+
+    Keep this in step with app.py so explain_queries() covers every hot path.
+    """
+    return {
+        'login/register/protected routes: user by email': User.query.filter_by(email='user@example.com'),
+        'register: verified user by email': VerifiedUser.query.filter_by(email='user@example.com'),
+        'apply_loan: user, verified user and customer': applicant('user@example.com'),
+        'user_dashboard: applications of a user, newest first': user_applications(1),
+        'manage_loans: first page': loan_listing(),
+        'manage_loans: status filter': loan_listing(status='Pending'),
+        'manage_loans: date range, next page': loan_listing(
+            date_from=datetime(2025, 1, 1), date_to=datetime(2025, 2, 1), after='2025-01-15T00:00:00|10'
+        ),
+        'manage_loans: amount sort, next page': loan_listing(sort='amount_desc', after='50000.0|10'),
+        'loans by aadhaar number': LoanApplication.query.filter_by(aadhaar_number=123456789012),
+        'approve_loan/reject_loan: loan by id': LoanApplication.query.filter_by(id=1),
+        'score-worker: oldest queued applications': LoanApplication.query.filter(
+            LoanApplication.scoring_queued_at.isnot(None)
+        ).order_by(LoanApplication.scoring_queued_at, LoanApplication.id).limit(256),
+        'export-applications: next chunk past the watermark': export_chunk(
+            after=(datetime(2025, 1, 1), 10), until=datetime(2025, 2, 1)
+        ),
+    }
+
+
+def explain_queries():
+    """Run EXPLAIN QUERY PLAN (SQLite) for every hot query. Returns [(name, sql, [plan details])]."""
+    results = []
+    with db.engine.connect() as conn:
+        for name, query in hot_queries().items():
+            statement = query.statement if hasattr(query, 'statement') else query
+            sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+            plan = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+            results.append((name, sql, [row[-1] for row in plan]))
+    return results
+
+
+def is_full_scan(detail):
+    # "SCAN <table>" without an index means SQLite reads the whole table
+    return detail.startswith('SCAN ') and ' USING ' not in detail
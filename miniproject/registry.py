@@ -0,0 +1,332 @@
+"""Versioned model registry and the per-process active model.
+
+Published models live in LOAN_MODEL_REGISTRY, one directory per version holding the
+pickle and its memory-mappable artifact:
+
+    model_registry/
+        CURRENT                      <- name of the version to serve
+        20261018T120000-1a2b3c4d/
+            model.pkl
+            model.flat/
+
+Each process serves one ModelVersion at a time. reload() loads the version CURRENT
+names next to the one in use and then swaps a single reference, so a request keeps
+the version it started with and scoring never waits on a load. A watcher thread
+polls CURRENT every LOAN_MODEL_WATCH_INTERVAL seconds, which is how every worker
+follows `flask activate-model`; an admin can also trigger a reload through the app.
+Without a CURRENT file, MODEL_PATH and ARTIFACT_PATH are served as before.
+
+A second version can be named in CANDIDATE (`flask candidate-model`), with the
+percentage of decisions it makes; shadow.py scores it against the current one.
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from artifact import MANIFEST, ArtifactError, file_sha256, load_artifact, read_manifest
+from ourmodel import ARTIFACT_PATH, BASE_DIR, FEATURES, MODEL_PATH
+
+REGISTRY_PATH = os.environ.get('LOAN_MODEL_REGISTRY', os.path.join(BASE_DIR, 'model_registry'))
+WATCH_INTERVAL = float(os.environ.get('LOAN_MODEL_WATCH_INTERVAL', 5))  # Seconds; 0 turns the watcher off
+CURRENT = 'CURRENT'
+CANDIDATE = 'CANDIDATE'
+MODEL_FILE = 'model.pkl'
+ARTIFACT_DIR = 'model.flat'
+
+log = logging.getLogger('loan')
+
+
+class RegistryError(Exception):
+    """Raised for an unknown version or a model that cannot be published."""
+
+
+#----------------------------------------------------------------LOADED VERSIONS----------------------------------------------------------------
+class ModelVersion:
+    """One model version as loaded by this process. Each form is built once, then shared by all threads."""
+
+    def __init__(self, version, model_path, artifact_path):
+        self.version = version
+        self.model_path = model_path
+        self.artifact_path = artifact_path
+        self._model = None
+        self._flat_model = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<ModelVersion {self.version}>'
+
+    def sklearn(self):
+        """The unpickled RandomForestClassifier."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    with open(self.model_path, 'rb') as f:
+                        self._model = pickle.load(f)
+        return self._model
+
+    def flat(self):
+        """The flattened forest.
+
+        If the version has an exported artifact its arrays are memory-mapped, so the
+        pickle is never unpickled; a stale or mismatched artifact raises ArtifactError.
+        Without one the forest is flattened from sklearn().
+        """
+        if self._flat_model is None:
+            from flatforest import FlatForest
+
+            if os.path.exists(os.path.join(self.artifact_path, MANIFEST)):
+                with self._lock:
+                    if self._flat_model is None:
+                        self._flat_model = load_artifact(self.artifact_path, FEATURES, source=self.model_path)
+            else:
+                model = self.sklearn()
+                with self._lock:
+                    if self._flat_model is None:
+                        self._flat_model = FlatForest.from_sklearn(model)
+        return self._flat_model
+
+    def warm(self, engine):
+        """Load what engine scores with, so the first request after a swap does not pay for it."""
+        return self.flat() if engine == 'flat' else self.sklearn()
+
+
+#----------------------------------------------------------------REGISTRY----------------------------------------------------------------
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_PATH, fallback_model=MODEL_PATH, fallback_artifact=ARTIFACT_PATH):
+        self.root = root
+        self.fallback_model = fallback_model
+        self.fallback_artifact = fallback_artifact
+        self._fallback_version = (None, None)  # ((mtime, size), version) of fallback_model
+
+    def paths(self, version):
+        return os.path.join(self.root, version, MODEL_FILE), os.path.join(self.root, version, ARTIFACT_DIR)
+
+    def current_version(self):
+        """The version CURRENT names, or None when nothing has been published."""
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def resolve(self):
+        """(version, pickle path, artifact path) of the model to serve. Cheap enough to poll."""
+        version = self.current_version()
+        if version is not None:
+            return (version, *self.paths(version))
+
+        # Unpublished model: named after the pickle's hash, recomputed only when the file changes
+        stat = os.stat(self.fallback_model)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._fallback_version[0] != key:
+            name = f'{os.path.basename(self.fallback_model)}@{file_sha256(self.fallback_model)[:8]}'
+            self._fallback_version = (key, name)
+        return self._fallback_version[1], self.fallback_model, self.fallback_artifact
+
+    def versions(self):
+        """Published versions, oldest first, with the metadata stored in their artifact manifests."""
+        if not os.path.isdir(self.root):
+            return []
+        current = self.current_version()
+        candidate = self.candidate()
+        versions = []
+        for name in sorted(os.listdir(self.root)):
+            model_path, artifact_path = self.paths(name)
+            if name.startswith('.') or not os.path.isfile(model_path):
+                continue
+            try:
+                metadata = read_manifest(artifact_path).get('metadata', {})
+            except ArtifactError:
+                metadata = {}
+            versions.append({
+                'version': name, 'current': name == current,
+                'candidate': name == (candidate or {}).get('version'), 'metadata': metadata,
+            })
+        return versions
+
+    def activate(self, version):
+        """Point CURRENT at version; every process picks it up on its next reload."""
+        if not os.path.isfile(self.paths(version)[0]):
+            raise RegistryError(f"Unknown model version {version}")
+        tmp_path = os.path.join(self.root, CURRENT + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.root, CURRENT))
+        log.info("model version activated", extra={'version': version})
+
+    def candidate(self):
+        """{'version': ..., 'split': percent of decisions it makes} from CANDIDATE, or None."""
+        try:
+            with open(os.path.join(self.root, CANDIDATE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set_candidate(self, version, split=0.0):
+        """Shadow-score version against the current one; it makes split percent of the decisions."""
+        if not os.path.isfile(self.paths(version)[0]):
+            raise RegistryError(f"Unknown model version {version}")
+        if not 0 <= split <= 100:
+            raise RegistryError("The split is a percentage between 0 and 100")
+        tmp_path = os.path.join(self.root, CANDIDATE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'split': float(split)}, f)
+        os.replace(tmp_path, os.path.join(self.root, CANDIDATE))
+        log.info("candidate model set", extra={'version': version, 'split': split})
+
+    def clear_candidate(self):
+        try:
+            os.unlink(os.path.join(self.root, CANDIDATE))
+        except FileNotFoundError:
+            return
+        log.info("candidate model cleared")
+
+    def publish(self, model_path, artifact_path=None, activate=True):
+        """Copy a pickle (and its artifact, exported here if missing) in as a new version. Returns its name."""
+        from ourmodel import export_artifact
+
+        digest = file_sha256(model_path)
+        version = f'{datetime.utcnow():%Y%m%dT%H%M%S}-{digest[:8]}'
+        final_path = os.path.join(self.root, version)
+        if os.path.exists(final_path):
+            raise RegistryError(f"Model version {version} already exists")
+
+        # Assembled under a hidden name and renamed, so a half-copied version is never listed
+        tmp_path = os.path.join(self.root, f'.{version}.tmp')
+        os.makedirs(tmp_path)
+        try:
+            tmp_model = os.path.join(tmp_path, MODEL_FILE)
+            tmp_artifact = os.path.join(tmp_path, ARTIFACT_DIR)
+            shutil.copy2(model_path, tmp_model)
+            if artifact_path and os.path.exists(os.path.join(artifact_path, MANIFEST)):
+                shutil.copytree(artifact_path, tmp_artifact)
+            else:
+                with open(tmp_model, 'rb') as f:
+                    export_artifact(pickle.load(f), tmp_artifact, source=tmp_model)
+            # Refuse a stale or corrupt artifact now rather than in every worker after activation
+            load_artifact(tmp_artifact, FEATURES, source=tmp_model)
+            os.rename(tmp_path, final_path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        log.info("model version published", extra={'version': version, 'source': model_path})
+        if activate:
+            self.activate(version)
+        return version
+
+
+#----------------------------------------------------------------ACTIVE MODEL----------------------------------------------------------------
+class ActiveModel:
+    """The ModelVersion this process scores with, swapped in place by reload()."""
+
+    def __init__(self, registry, engine='flat', watch_interval=WATCH_INTERVAL):
+        self.registry = registry
+        self.engine = engine
+        self.watch_interval = watch_interval
+        self._current = None
+        self._candidate = None  # (ModelVersion, split percent) or None
+        self._failed = None  # Version whose load last failed, so the watcher logs it once
+        self._failed_candidate = None
+        self._reload_lock = threading.Lock()
+        self._watcher_lock = threading.Lock()
+        self._watcher_pid = None
+
+    def get(self):
+        """The version to score a request with. Never waits on a reload once a version is loaded."""
+        current = self._current
+        if current is None:
+            self.reload()  # First use in this process: there is nothing to serve yet
+            current = self._current
+        if self.watch_interval and self._watcher_pid != os.getpid():
+            # Threads do not survive a fork, so each (pre)forked worker starts its own watcher
+            self.start_watcher()
+        return current
+
+    def candidate(self):
+        """(ModelVersion, split percent) of the candidate, or None when there is no experiment."""
+        return self._candidate
+
+    def reload(self, force=False):
+        """Swap in the version CURRENT names if it is not the one in use. Returns (version, changed).
+
+        The candidate is brought in line with CANDIDATE as well.
+        """
+        with self._reload_lock:
+            version, model_path, artifact_path = self.registry.resolve()
+            previous = self._current
+            changed = previous is None or previous.version != version or force
+            if changed:
+                loaded = ModelVersion(version, model_path, artifact_path)
+                loaded.warm(self.engine)
+                # A single reference swap: requests in flight keep the version they already hold
+                self._current = loaded
+                self._failed = None
+            self._reload_candidate()
+        if changed:
+            log.info("model version loaded", extra={
+                'version': version, 'previous': previous.version if previous else None, 'pid': os.getpid(),
+            })
+        return version, changed
+
+    def _reload_candidate(self):
+        entry = self.registry.candidate()
+        if entry is None:
+            self._candidate = None
+            return
+        current = self._candidate
+        if current is not None and current[0].version == entry['version']:
+            if current[1] != entry['split']:
+                self._candidate = (current[0], entry['split'])
+            return
+        try:
+            loaded = ModelVersion(entry['version'], *self.registry.paths(entry['version']))
+            loaded.warm(self.engine)
+        except Exception as e:
+            # A broken candidate ends the experiment; it never affects the current version
+            self._candidate = None
+            if self._failed_candidate != entry['version']:
+                self._failed_candidate = entry['version']
+                log.error("candidate model load failed", extra={'version': entry['version'], 'error': str(e)})
+            return
+        self._candidate = (loaded, entry['split'])
+        log.info("candidate model loaded", extra={'version': entry['version'], 'split': entry['split'], 'pid': os.getpid()})
+
+    def start_watcher(self):
+        with self._watcher_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name='model-watcher', daemon=True).start()
+
+    def _watch(self):
+        pid = os.getpid()
+        while self._watcher_pid == pid:
+            time.sleep(self.watch_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the loaded version; a bad publish must not take scoring down
+                version = self.registry.current_version()
+                if self._failed != version:
+                    self._failed = version
+                    log.error("model reload failed", extra={'version': version, 'error': str(e)})
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active_models():
+    """The process-wide ActiveModel, serving LOAN_INFERENCE_ENGINE from REGISTRY_PATH."""
+    global _active
+    if _active is None:
+        with _active_lock:
+            if _active is None:
+                _active = ActiveModel(ModelRegistry(), engine=os.environ.get('LOAN_INFERENCE_ENGINE', 'flat'))
+    return _active
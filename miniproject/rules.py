@@ -0,0 +1,126 @@
+import numpy as np
+
+EMPLOYED_STATUSES = ("Employed", "Self-Employed")
+MIN_CREDIT_SCORE = 501
+MAX_LOAN_TO_INCOME = 0.8333
+
+# Reason codes, in the order they are reported
+LOW_CREDIT_SCORE = 'low_credit_score'
+UNEMPLOYED = 'unemployed'
+INCOME_TOO_LOW = 'income_too_low'
+REASONS = (LOW_CREDIT_SCORE, UNEMPLOYED, INCOME_TOO_LOW)
+
+# Used when the model rejects an application that breaks none of the rules
+DEFAULT_REASON = "❌ REJECTED: Loan denied based on internal checks"
+DEFAULT_SUGGESTION = "💡 Suggestion: Contact the bank for a detailed review"
+
+# Used when the model approves but the application does not match the applicant's KYC record
+KYC_MISMATCH_REASON = "❌ REJECTED: Application details do not match verified KYC records"
+APPROVED_SUGGESTION = "Loan application processed successfully"
+
+# apply_loan's auto-rejection of applicants whose KYC record is marked as rejected by another bank
+OTHER_BANK_REASON = "Previous rejection in another bank"
+
+
+def encode_employment_status(employment_status):
+    """1 for an employed/self-employed status, else 0. Accepts a single status or an array of them."""
+    encoded = np.isin(employment_status, EMPLOYED_STATUSES).astype(np.int64)
+    return int(encoded) if encoded.ndim == 0 else encoded
+
+
+def _money(amount):
+    return f"{amount:,.0f}" if float(amount).is_integer() else f"{amount:,.2f}"
+
+
+class Evaluation:
+    """Rule results for a batch of applications.
+
+    masks[i, j] is True when application i breaks rule REASONS[j]; max_loan[i] is the
+    largest loan application i's income supports.
+    """
+
+    def __init__(self, income, credit_score, loan_amount, masks, max_loan):
+        self.income = income
+        self.credit_score = credit_score
+        self.loan_amount = loan_amount
+        self.masks = masks
+        self.max_loan = max_loan
+
+    def __len__(self):
+        return len(self.masks)
+
+    @property
+    def failed(self):
+        """Mask of applications that break at least one rule."""
+        return self.masks.any(axis=1)
+
+    def codes(self, i):
+        return [REASONS[j] for j in np.flatnonzero(self.masks[i])]
+
+    def messages(self, i):
+        """(reason, suggestion) text for application i, or (None, None) if it breaks no rule."""
+        codes = self.codes(i)
+        if not codes:
+            return None, None
+
+        reasons, suggestions = [], []
+        if LOW_CREDIT_SCORE in codes:
+            reasons.append(f"Credit score ({int(self.credit_score[i])}) ≤ {MIN_CREDIT_SCORE - 1}")
+            suggestions.append(f"Increase your credit score to at least {MIN_CREDIT_SCORE}")
+        if UNEMPLOYED in codes:
+            reasons.append("Unemployed applicants do not qualify")
+            suggestions.append("Only employed or self-employed applicants qualify")
+        if INCOME_TOO_LOW in codes:
+            reasons.append(f"Income (₹{_money(self.income[i])}) too low for ₹{_money(self.loan_amount[i])} loan")
+            suggestions.append(f"Apply for ₹{_money(self.max_loan[i])} or less")
+
+        return "❌ REJECTED: " + "; ".join(reasons), "💡 Suggestion: " + "; ".join(suggestions)
+
+    def all_messages(self):
+        """(reasons, suggestions) lists for the whole batch; only failing rows are formatted."""
+        reasons = [None] * len(self)
+        suggestions = [None] * len(self)
+        for i in np.flatnonzero(self.failed):
+            reasons[i], suggestions[i] = self.messages(i)
+        return reasons, suggestions
+
+
+def evaluate(income, credit_score, loan_amount, employed):
+    """Evaluate every rule over arrays of applications at once. employed is 0/1 per application."""
+    income = np.asarray(income, dtype=np.float64).reshape(-1)
+    credit_score = np.asarray(credit_score, dtype=np.float64).reshape(-1)
+    loan_amount = np.asarray(loan_amount, dtype=np.float64).reshape(-1)
+    employed = np.asarray(employed).reshape(-1)
+
+    max_loan = np.round(income * MAX_LOAN_TO_INCOME, 2)
+    masks = np.column_stack([
+        credit_score < MIN_CREDIT_SCORE,
+        employed == 0,
+        loan_amount > income * MAX_LOAN_TO_INCOME,
+    ])
+    return Evaluation(income, credit_score, loan_amount, masks, max_loan)
+
+
+def explain(income, credit_score, loan_amount, employed):
+    """(reason, suggestion) for one rejected application, falling back to the default texts."""
+    reason, suggestion = evaluate(income, credit_score, loan_amount, employed).messages(0)
+    return reason or DEFAULT_REASON, suggestion or DEFAULT_SUGGESTION
+
+
+def decide(prediction, verified, reason=None, suggestion=None, model_version=None):
+    """Column values for a scored application.
+
+    prediction is the model's "Approved"/"Rejected" and verified whether the application
+    matched the applicant's KYC record; reason and suggestion are explain()'s texts for a
+    model rejection. model_version is the registry version that made the prediction.
+    """
+    final_decision = "Approved" if verified and prediction == "Approved" else "Rejected"
+    if final_decision == "Rejected" and not reason:
+        reason = KYC_MISMATCH_REASON
+    return {
+        'prediction': final_decision,
+        'rejection_reason': reason if final_decision == "Rejected" else None,
+        'rejection_suggestion': suggestion if prediction == "Rejected" else None,
+        'suggestion': suggestion if prediction == "Rejected" else APPROVED_SUGGESTION,
+        'model_version': model_version,
+    }
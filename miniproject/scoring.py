@@ -0,0 +1,139 @@
+"""Asynchronous scoring of loan applications.
+
+With LOAN_ASYNC_SCORING on, apply_loan saves a verified application as Pending with
+scoring_queued_at set and returns straight away. Workers (`flask score-worker`) claim
+queued applications in batches, score each batch with a single predict call and write
+the decisions back. The loan_application table is the queue, so nothing is lost on a
+restart and any number of worker processes can share it.
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+
+from models import db, LoanApplication, Customer
+from registry import active_models
+from shadow import pick_models
+from stats import StatDeltas
+from rules import encode_employment_status, evaluate, decide, DEFAULT_REASON, DEFAULT_SUGGESTION
+
+# What the worker needs to score an application and record the decision
+QUEUE_COLUMNS = (
+    LoanApplication.id,
+    LoanApplication.user_id,
+    LoanApplication.income,
+    LoanApplication.credit_score,
+    LoanApplication.loan_amount,
+    LoanApplication.employment_status,
+    LoanApplication.flag,
+    LoanApplication.created_at,
+)
+
+
+def new_worker_id():
+    return uuid.uuid4().hex
+
+
+def claim_batch(worker_id, batch_size, stale_after=300):
+    """Claim up to batch_size queued applications for worker_id and return their QUEUE_COLUMNS rows.
+
+    Claims older than stale_after seconds (a worker that died mid-batch) are taken over.
+    """
+    now = datetime.utcnow()
+    claimable = db.or_(
+        LoanApplication.scoring_claimed_by.is_(None),
+        LoanApplication.scoring_claimed_at < now - timedelta(seconds=stale_after),
+    )
+    oldest = (
+        select(LoanApplication.id)
+        .where(LoanApplication.scoring_queued_at.isnot(None), claimable)
+        .order_by(LoanApplication.scoring_queued_at, LoanApplication.id)
+        .limit(batch_size)
+    )
+    # claimable is checked again by the UPDATE itself, so two workers never claim the same row
+    db.session.execute(
+        update(LoanApplication)
+        .where(LoanApplication.id.in_(oldest.scalar_subquery()), claimable)
+        .values(scoring_claimed_by=worker_id, scoring_claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    return (
+        db.session.query(*QUEUE_COLUMNS)
+        .filter(LoanApplication.scoring_claimed_by == worker_id, LoanApplication.scoring_queued_at.isnot(None))
+        .order_by(LoanApplication.id)
+        .all()
+    )
+
+
+def score_batch(rows, predict):
+    """Score claimed rows and write the decisions back in one transaction. Returns {decision: count}.
+
+    predict is app.predict_loans: (n, 4) FEATURES rows -> (decisions, probabilities). The whole
+    batch is scored, and recorded, with the model version active when it starts; with a
+    candidate set, the A/B split is drawn per batch rather than per application.
+    """
+    ids, user_ids, income, credit_score, loan_amount, employment_status, flags, created_at = zip(*rows)
+    employed = encode_employment_status(list(employment_status))
+    model, shadow = pick_models(active_models())
+    predictions, _ = predict(np.column_stack([income, credit_score, loan_amount, employed]), model=model, shadow=shadow)
+    reasons, suggestions = evaluate(income, credit_score, loan_amount, employed).all_messages()
+
+    applications, customers, counts = [], [], {}
+    stats = StatDeltas()
+    for i, prediction in enumerate(predictions):
+        reason = suggestion = None
+        if prediction == "Rejected":
+            reason = reasons[i] or DEFAULT_REASON
+            suggestion = suggestions[i] or DEFAULT_SUGGESTION
+        decision = decide(prediction, flags[i], reason, suggestion, model.version)
+        applications.append({
+            'id': ids[i],
+            **decision,
+            'scoring_queued_at': None,
+            'scoring_claimed_by': None,
+            'scoring_claimed_at': None,
+        })
+        # Same as the synchronous path, which keeps the latest suggestion on the customer record
+        customers.append({'b_user_id': user_ids[i], 'b_payment_mode': suggestion or "No Suggestion"})
+        counts[decision['prediction']] = counts.get(decision['prediction'], 0) + 1
+        stats.move(created_at[i], credit_score[i], 'Pending', decision['prediction'], loan_amount[i], income[i])
+
+    db.session.execute(update(LoanApplication), applications)
+    db.session.execute(
+        update(Customer.__table__)
+        .where(Customer.__table__.c.user_id == bindparam('b_user_id'))
+        .values(payment_mode=bindparam('b_payment_mode')),
+        customers,
+    )
+    stats.apply()
+    db.session.commit()
+    return counts
+
+
+def queue_length():
+    return LoanApplication.query.filter(LoanApplication.scoring_queued_at.isnot(None)).count()
+
+
+def run_worker(predict, batch_size=256, poll_interval=1.0, stale_after=300, once=False, log=print):
+    """Claim and score batches until stopped, sleeping poll_interval when the queue is empty.
+
+    With once, return the number of applications scored as soon as the queue is drained.
+    """
+    worker_id = new_worker_id()
+    scored = 0
+    while True:
+        rows = claim_batch(worker_id, batch_size, stale_after)
+        if rows:
+            started = time.perf_counter()
+            counts = score_batch(rows, predict)
+            scored += len(rows)
+            elapsed = (time.perf_counter() - started) * 1000
+            log(f"worker {worker_id[:8]}: scored {len(rows)} applications in {elapsed:.1f} ms {counts}")
+            continue
+        if once:
+            return scored
+        time.sleep(poll_interval)
@@ -0,0 +1,196 @@
+"""Shadow scoring of a candidate model version, and the A/B split between versions.
+
+With a candidate set (`flask candidate-model`, see registry.py) every scored
+application is also scored by the version that did not decide it. That second
+predict runs on a small background pool after the live decision is made, so the
+request only pays for handing the feature vector over. Each pair of predictions is
+buffered and written to shadow_comparison in batches; `flask shadow-report` sums up
+agreement and latency per pair of versions.
+
+The candidate's split is the percentage of applications it decides itself, with the
+current version running in the shadow instead. When the pool falls behind, new
+comparisons are dropped (loan_shadow_comparisons_total{outcome="dropped"}) rather
+than queued without bound.
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func, insert
+
+from metrics import SHADOW_COMPARISONS
+from models import db, ShadowComparison
+
+SHADOW_WORKERS = int(os.environ.get('LOAN_SHADOW_WORKERS', 2))
+SHADOW_MAX_PENDING = int(os.environ.get('LOAN_SHADOW_MAX_PENDING', 1000))  # Comparisons waiting for the pool
+FLUSH_ROWS = 200
+FLUSH_INTERVAL = 5.0  # Seconds
+
+log = logging.getLogger('loan')
+
+# The version to run in the shadow of a decision, and whether the candidate made that decision
+Shadow = namedtuple('Shadow', ('model', 'candidate_decided'))
+
+
+def pick_models(models):
+    """(ModelVersion to decide with, Shadow or None) for one application or batch.
+
+    models is the registry ActiveModel. Without a candidate (or with the current
+    version as candidate) there is nothing to compare against.
+    """
+    current = models.get()
+    candidate = models.candidate()
+    if candidate is None or candidate[0].version == current.version:
+        return current, None
+    model, split = candidate
+    if split and random.random() * 100 < split:
+        return model, Shadow(current, True)
+    return current, Shadow(model, False)
+
+
+class ShadowScorer:
+    """Scores feature vectors with a shadow version off the request path and records the comparison."""
+
+    def __init__(self, app, engine='flat', workers=SHADOW_WORKERS, max_pending=SHADOW_MAX_PENDING,
+                 flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.app = app
+        self.engine = engine
+        self.workers = workers
+        self.max_pending = max_pending
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._pool = None
+        self._pool_pid = None
+        self._pending = 0
+        self._rows = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _executor(self):
+        # Threads do not survive a fork, so each (pre)forked worker gets its own pool
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='shadow-scorer')
+                    self._pending = 0
+                    self._rows = []
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def compare(self, shadow, X, live_model, live_predictions, live_seconds):
+        """Queue X (the (n, 4) rows live_model decided as live_predictions) for scoring by shadow.model."""
+        pool = self._executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                SHADOW_COMPARISONS.inc(len(live_predictions), outcome='dropped')
+                return
+            self._pending += 1
+        pool.submit(self._run, shadow, X, live_model.version, live_predictions, live_seconds)
+
+    def _run(self, shadow, X, live_version, live_predictions, live_seconds):
+        try:
+            started = time.perf_counter()
+            approved = shadow.model.warm(self.engine).predict(X) == 1
+            shadow_seconds = time.perf_counter() - started
+        except Exception as e:
+            SHADOW_COMPARISONS.inc(len(live_predictions), outcome='failed')
+            log.error("shadow scoring failed", extra={'version': shadow.model.version, 'error': str(e)})
+            with self._lock:
+                self._pending -= 1
+            return
+
+        # Per-application latency, so a batch compares with a single request
+        live_ms = live_seconds * 1000 / len(X)
+        shadow_ms = shadow_seconds * 1000 / len(X)
+        now = datetime.utcnow()
+        rows = []
+        for i, live_prediction in enumerate(live_predictions):
+            shadow_prediction = "Approved" if approved[i] else "Rejected"
+            agree = shadow_prediction == live_prediction
+            SHADOW_COMPARISONS.inc(outcome='agree' if agree else 'disagree')
+            income, credit_score, loan_amount, employment_status = X[i]
+            rows.append({
+                'created_at': now,
+                'live_version': live_version,
+                'shadow_version': shadow.model.version,
+                'candidate_decided': shadow.candidate_decided,
+                'live_prediction': live_prediction,
+                'shadow_prediction': shadow_prediction,
+                'agree': agree,
+                'live_ms': live_ms,
+                'shadow_ms': shadow_ms,
+                'income': float(income),
+                'credit_score': int(credit_score),
+                'loan_amount': float(loan_amount),
+                'employment_status': int(employment_status),
+            })
+
+        with self._lock:
+            self._pending -= 1
+            self._rows.extend(rows)
+            due = (len(self._rows) >= self.flush_rows
+                   or time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered comparisons in one INSERT."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._flushed_at = time.monotonic()
+        if not rows:
+            return
+        try:
+            with self.app.app_context():
+                db.session.execute(insert(ShadowComparison.__table__), rows)
+                db.session.commit()
+        except Exception as e:
+            # Comparisons are diagnostics: losing a batch must never affect scoring
+            log.error("shadow comparisons not saved", extra={'rows': len(rows), 'error': str(e)})
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=True)
+            self.flush()
+
+
+def shadow_report(since):
+    """Agreement and per-application latency for each pair of versions compared since `since`."""
+    rows = (
+        db.session.query(
+            ShadowComparison.live_version,
+            ShadowComparison.shadow_version,
+            ShadowComparison.candidate_decided,
+            func.count(),
+            func.sum(db.case((ShadowComparison.agree, 0), else_=1)),
+            func.avg(ShadowComparison.live_ms),
+            func.avg(ShadowComparison.shadow_ms),
+            func.sum(db.case((ShadowComparison.live_prediction == 'Approved', 1), else_=0)),
+            func.sum(db.case((ShadowComparison.shadow_prediction == 'Approved', 1), else_=0)),
+        )
+        .filter(ShadowComparison.created_at >= since)
+        .group_by(ShadowComparison.live_version, ShadowComparison.shadow_version, ShadowComparison.candidate_decided)
+        .order_by(ShadowComparison.live_version, ShadowComparison.shadow_version, ShadowComparison.candidate_decided)
+        .all()
+    )
+    return [{
+        'live_version': live_version,
+        'shadow_version': shadow_version,
+        'candidate_decided': bool(candidate_decided),
+        'comparisons': count,
+        'disagreements': int(disagreements),
+        'disagreement_rate': disagreements / count,
+        'live_ms': live_ms,
+        'shadow_ms': shadow_ms,
+        'latency_delta_ms': shadow_ms - live_ms,
+        'live_approval_rate': live_approved / count,
+        'shadow_approval_rate': shadow_approved / count,
+    } for (live_version, shadow_version, candidate_decided, count, disagreements,
+           live_ms, shadow_ms, live_approved, shadow_approved) in rows]
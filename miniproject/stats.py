@@ -0,0 +1,196 @@
+"""Portfolio statistics for the admin dashboard, maintained incrementally.
+
+Every write that creates an application or changes its prediction adds a delta to the
+PortfolioStat rows it falls in (overall, its day, its credit-score band), inside the
+same transaction, so the totals can never disagree with the applications they
+summarise. The dashboard then reads a handful of rows instead of aggregating
+loan_application. `flask rebuild-stats` recomputes everything from scratch.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, LoanApplication, PortfolioStat
+
+PREDICTIONS = ('Approved', 'Rejected', 'Pending')
+CREDIT_BAND_WIDTH = 50
+
+
+def credit_band(credit_score):
+    low = (int(credit_score) // CREDIT_BAND_WIDTH) * CREDIT_BAND_WIDTH
+    return f'{low}-{low + CREDIT_BAND_WIDTH - 1}'
+
+
+def buckets(created_at, credit_score):
+    """The (bucket_type, bucket) pairs an application is counted in."""
+    return (
+        ('all', ''),
+        ('day', (created_at or datetime.utcnow()).strftime('%Y-%m-%d')),
+        ('credit', credit_band(credit_score)),
+    )
+
+
+class StatDeltas:
+    """Changes to PortfolioStat rows, collected so each row is written once per transaction."""
+
+    def __init__(self):
+        # (bucket_type, bucket, prediction) -> [count, loan_amount_sum, income_sum]
+        self.deltas = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def add(self, created_at, credit_score, prediction, loan_amount, income, sign=1):
+        for bucket_type, bucket in buckets(created_at, credit_score):
+            delta = self.deltas[(bucket_type, bucket, prediction)]
+            delta[0] += sign
+            delta[1] += sign * float(loan_amount)
+            delta[2] += sign * float(income)
+
+    def move(self, created_at, credit_score, old_prediction, new_prediction, loan_amount, income):
+        if old_prediction != new_prediction:
+            self.add(created_at, credit_score, old_prediction, loan_amount, income, sign=-1)
+            self.add(created_at, credit_score, new_prediction, loan_amount, income)
+
+    def apply(self):
+        """Write the deltas in the current transaction (the caller commits)."""
+        rows = [
+            {'bucket_type': t, 'bucket': b, 'prediction': p,
+             'count': count, 'loan_amount_sum': amount, 'income_sum': income}
+            for (t, b, p), (count, amount, income) in self.deltas.items()
+            if count or amount or income
+        ]
+        self.deltas.clear()
+        if rows:
+            upsert_stats(rows)
+
+
+def upsert_stats(rows):
+    """Add each row's count and sums to its PortfolioStat row, creating it if needed."""
+    dialect_name = db.engine.dialect.name
+    if dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        table = PortfolioStat.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.bucket_type, table.c.bucket, table.c.prediction],
+            set_={
+                'count': table.c.count + statement.excluded['count'],
+                'loan_amount_sum': table.c.loan_amount_sum + statement.excluded.loan_amount_sum,
+                'income_sum': table.c.income_sum + statement.excluded.income_sum,
+            },
+        )
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        stat = PortfolioStat.query.filter_by(
+            bucket_type=row['bucket_type'], bucket=row['bucket'], prediction=row['prediction']
+        ).with_for_update().first()
+        if stat is None:
+            db.session.add(PortfolioStat(**row))
+        else:
+            stat.count += row['count']
+            stat.loan_amount_sum += row['loan_amount_sum']
+            stat.income_sum += row['income_sum']
+
+
+#----------------------------------------------------------------WRITE HOOKS----------------------------------------------------------------
+def record_new(loan):
+    """Count a newly added (flushed) LoanApplication."""
+    deltas = StatDeltas()
+    deltas.add(loan.created_at, loan.credit_score, loan.prediction, loan.loan_amount, loan.income)
+    deltas.apply()
+
+
+def record_change(loan, old_prediction):
+    """Move a LoanApplication from old_prediction to its current prediction."""
+    deltas = StatDeltas()
+    deltas.move(loan.created_at, loan.credit_score, old_prediction, loan.prediction, loan.loan_amount, loan.income)
+    deltas.apply()
+
+
+#----------------------------------------------------------------REBUILD----------------------------------------------------------------
+def rebuild_stats():
+    """Recompute every PortfolioStat row with one pass over loan_application. Returns the row count."""
+    day = func.date(LoanApplication.created_at)
+    band = (LoanApplication.credit_score / CREDIT_BAND_WIDTH) * CREDIT_BAND_WIDTH
+    groups = (
+        db.session.query(
+            day, band, LoanApplication.prediction,
+            func.count(), func.sum(LoanApplication.loan_amount), func.sum(LoanApplication.income),
+        )
+        .group_by(day, band, LoanApplication.prediction)
+    )
+
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for day_value, band_low, prediction, count, amount, income in groups:
+        prediction = prediction or 'Pending'
+        day_bucket = str(day_value)[:10] if day_value else ''
+        keys = (
+            ('all', '', prediction),
+            ('day', day_bucket, prediction),
+            ('credit', credit_band(band_low or 0), prediction),
+        )
+        for key in keys:
+            total = totals[key]
+            total[0] += count
+            total[1] += amount or 0.0
+            total[2] += income or 0.0
+
+    PortfolioStat.query.delete()
+    db.session.bulk_insert_mappings(PortfolioStat, [
+        {'bucket_type': t, 'bucket': b, 'prediction': p, 'count': c, 'loan_amount_sum': a, 'income_sum': i}
+        for (t, b, p), (c, a, i) in totals.items()
+    ])
+    db.session.commit()
+    return len(totals)
+
+
+#----------------------------------------------------------------READ----------------------------------------------------------------
+def _summarise(rows):
+    count = sum(r.count for r in rows)
+    amount = sum(r.loan_amount_sum for r in rows)
+    income = sum(r.income_sum for r in rows)
+    by_prediction = {p: 0 for p in PREDICTIONS}
+    for r in rows:
+        by_prediction[r.prediction] = by_prediction.get(r.prediction, 0) + r.count
+    decided = by_prediction['Approved'] + by_prediction['Rejected']
+    return {
+        'count': count,
+        'by_prediction': by_prediction,
+        'approval_rate': by_prediction['Approved'] / decided if decided else None,
+        'loan_amount_sum': amount,
+        'loan_amount_mean': amount / count if count else None,
+        'income_mean': income / count if count else None,
+    }
+
+
+def portfolio_summary(days=14):
+    """Overall totals, the last `days` days and the credit-score histogram, from PortfolioStat only."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    rows = PortfolioStat.query.filter(
+        db.or_(
+            PortfolioStat.bucket_type.in_(('all', 'credit')),
+            db.and_(PortfolioStat.bucket_type == 'day', PortfolioStat.bucket >= since),
+        )
+    ).all()
+
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[(row.bucket_type, row.bucket)].append(row)
+
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    return {
+        'overall': _summarise(grouped[('all', '')]),
+        'today': _summarise(grouped[('day', today)]),
+        'daily': [
+            {'day': bucket, **_summarise(items)}
+            for (bucket_type, bucket), items in sorted(grouped.items(), reverse=True) if bucket_type == 'day'
+        ],
+        'credit_bands': [
+            {'band': bucket, **_summarise(grouped[('credit', bucket)])}
+            for bucket in sorted((b for t, b in grouped if t == 'credit'), key=lambda b: int(b.split('-')[0]))
+        ],
+    }
@@ -0,0 +1,253 @@
+"""Training the loan model on recorded application history.
+
+Labels are the decisions stored on LoanApplication, including admin overrides made
+through approve_loan/reject_loan: Approved is 1, Rejected is 0. Pending applications
+are skipped, and so are rejections that say nothing about creditworthiness (KYC
+mismatches, earlier rejection by another bank). employment_status is encoded the way
+apply_loan encodes it (rules.encode_employment_status).
+
+History is streamed in chunks, by id from the database or piece by piece from a
+columnar export (see analytics.py), so memory is bounded by the chunk size rather
+than the history. An export also keeps a latest-version mask of about 9 bytes per
+exported row, to skip rows a later part superseded.
+The forest is grown with warm_start: each chunk adds trees fitted on that chunk,
+in proportion to its share of the history, with n_jobs building them in parallel.
+Applications whose id is a multiple of HOLDOUT_MODULUS are held out and scored in a
+second pass to produce the metrics stored with the model.
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func
+
+from models import db, LoanApplication
+from ourmodel import FEATURES
+from rules import encode_employment_status, KYC_MISMATCH_REASON, OTHER_BANK_REASON
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_TREES = 200
+DEFAULT_MAX_DEPTH = 10
+DEFAULT_MIN_ROWS = 100
+# Every 5th application is held out for evaluation (20%, like ourmodel.train_model's split)
+HOLDOUT_MODULUS = 5
+LABELS = {'Approved': 1, 'Rejected': 0}
+NON_CREDIT_REASONS = (KYC_MISMATCH_REASON, OTHER_BANK_REASON)
+
+HISTORY_COLUMNS = (
+    LoanApplication.id,
+    LoanApplication.income,
+    LoanApplication.credit_score,
+    LoanApplication.loan_amount,
+    LoanApplication.employment_status,
+    LoanApplication.prediction,
+)
+
+
+class TrainingError(Exception):
+    """Raised when the history cannot produce a model (too few rows, a single class, ...)."""
+
+
+def features(income, credit_score, loan_amount, employment_status):
+    """(n, 4) FEATURES matrix from column sequences, employment_status as stored."""
+    return np.column_stack([
+        np.asarray(income, dtype=np.float64),
+        np.asarray(credit_score, dtype=np.float64),
+        np.asarray(loan_amount, dtype=np.float64),
+        encode_employment_status(np.asarray(employment_status)),
+    ])
+
+
+def labels(prediction):
+    return (np.asarray(prediction) == 'Approved').astype(np.int64)
+
+
+#----------------------------------------------------------------SOURCES----------------------------------------------------------------
+class DatabaseHistory:
+    """Labelled applications read straight from loan_application, keyset-paginated by id."""
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def __str__(self):
+        return 'database'
+
+    def _query(self, query, holdout):
+        in_holdout = LoanApplication.id % HOLDOUT_MODULUS == 0
+        return query.filter(
+            LoanApplication.prediction.in_(tuple(LABELS)),
+            db.or_(
+                LoanApplication.prediction == 'Approved',
+                LoanApplication.rejection_reason.is_(None),
+                LoanApplication.rejection_reason.notin_(NON_CREDIT_REASONS),
+            ),
+            in_holdout if holdout else db.not_(in_holdout),
+        )
+
+    def class_counts(self, holdout=False):
+        query = self._query(db.session.query(LoanApplication.prediction, func.count()), holdout)
+        counts = dict(query.group_by(LoanApplication.prediction).all())
+        return {LABELS[name]: counts.get(name, 0) for name in LABELS}
+
+    def chunks(self, holdout=False):
+        """Yield (X, y) chunks of at most chunk_size rows."""
+        query = self._query(db.session.query(*HISTORY_COLUMNS), holdout)
+        last_id = 0
+        while True:
+            rows = (query.filter(LoanApplication.id > last_id)
+                    .order_by(LoanApplication.id)
+                    .limit(self.chunk_size)
+                    .all())
+            if not rows:
+                return
+            ids, income, credit_score, loan_amount, employment_status, prediction = zip(*rows)
+            yield features(income, credit_score, loan_amount, employment_status), labels(prediction)
+            last_id = ids[-1]
+
+
+class ExportHistory:
+    """Labelled applications from a columnar export, read one piece (file, row group or record batch) at a time."""
+
+    COLUMNS = ('income', 'credit_score', 'loan_amount', 'employment_status', 'prediction', 'rejection_reason')
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        from analytics import latest_rows
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.latest = latest_rows(path)
+
+    def __str__(self):
+        return f'export {self.path}'
+
+    def _pieces(self, columns, holdout):
+        """The selected rows of each export piece, as {column: array}."""
+        from analytics import iter_export
+
+        for data in iter_export(self.path, ('rejection_reason',) + columns, latest=self.latest):
+            selected = np.isin(data['prediction'], tuple(LABELS)) & ~(
+                (data['prediction'] == 'Rejected') & np.isin(data['rejection_reason'], NON_CREDIT_REASONS)
+            ) & ((data['id'] % HOLDOUT_MODULUS == 0) == holdout)
+            if selected.any():
+                yield {name: data[name][selected] for name in columns}
+
+    def class_counts(self, holdout=False):
+        approved = total = 0
+        for data in self._pieces(('prediction',), holdout):
+            y = labels(data['prediction'])
+            approved += int(y.sum())
+            total += len(y)
+        return {1: approved, 0: total - approved}
+
+    def chunks(self, holdout=False):
+        """Yield (X, y) chunks of chunk_size rows (the last may be shorter), regrouped from the export's pieces."""
+        buffered, rows = [], 0
+        for data in self._pieces(self.COLUMNS[:-1], holdout):
+            buffered.append(data)
+            rows += len(data['prediction'])
+            while rows >= self.chunk_size:
+                chunk = {name: np.concatenate([piece[name] for piece in buffered]) for name in buffered[0]}
+                yield self._xy(chunk, slice(0, self.chunk_size))
+                rest = {name: values[self.chunk_size:] for name, values in chunk.items()}
+                buffered, rows = [rest], rows - self.chunk_size
+        if rows:
+            chunk = {name: np.concatenate([piece[name] for piece in buffered]) for name in buffered[0]}
+            yield self._xy(chunk, slice(None))
+
+    @staticmethod
+    def _xy(chunk, take):
+        return (
+            features(*(chunk[name][take] for name in ('income', 'credit_score', 'loan_amount', 'employment_status'))),
+            labels(chunk['prediction'][take]),
+        )
+
+
+#----------------------------------------------------------------TRAINING----------------------------------------------------------------
+def fit_forest(history, n_trees=DEFAULT_TREES, max_depth=DEFAULT_MAX_DEPTH, n_jobs=-1, seed=42,
+               min_rows=DEFAULT_MIN_ROWS, log=print):
+    """Grow a RandomForestClassifier over history's training chunks. Returns (model, class counts)."""
+    from sklearn.ensemble import RandomForestClassifier
+
+    counts = history.class_counts()
+    total = counts[0] + counts[1]
+    if total < min_rows:
+        raise TrainingError(f"Only {total} labelled applications to train on, need at least {min_rows}")
+    if not counts[0] or not counts[1]:
+        raise TrainingError("The history needs both approved and rejected applications")
+
+    # Weights of the whole history, as class_weight='balanced' would compute them in one fit
+    class_weight = {label: total / (2 * count) for label, count in counts.items()}
+    model = RandomForestClassifier(
+        n_estimators=0, max_depth=max_depth, class_weight=class_weight,
+        n_jobs=n_jobs, random_state=seed, warm_start=True,
+    )
+
+    held_X = held_y = None
+    seen = 0
+    for X, y in history.chunks():
+        if held_X is not None:
+            X, y = np.vstack([held_X, X]), np.concatenate([held_y, y])
+            held_X = held_y = None
+        if len(np.unique(y)) < 2:
+            # Every fit must see both classes; carry a one-class chunk into the next one
+            held_X, held_y = X, y
+            continue
+        seen += len(y)
+        started = time.perf_counter()
+        model.n_estimators += max(1, round(n_trees * len(y) / total))
+        model.fit(X, y)
+        log(f"trained on {seen}/{total} applications, {model.n_estimators} trees "
+            f"({time.perf_counter() - started:.1f}s for this chunk)")
+    if held_X is not None:
+        log(f"skipped the last {len(held_y)} applications: they are all one class")
+    if not model.n_estimators:
+        raise TrainingError("No chunk of the history had both approved and rejected applications")
+    return model, counts
+
+
+def evaluate_model(model, history):
+    """Confusion counts and the usual scores of model on history's holdout chunks."""
+    tp = fp = tn = fn = 0
+    for X, y in history.chunks(holdout=True):
+        predicted = model.predict(X)
+        tp += int(np.sum((predicted == 1) & (y == 1)))
+        fp += int(np.sum((predicted == 1) & (y == 0)))
+        tn += int(np.sum((predicted == 0) & (y == 0)))
+        fn += int(np.sum((predicted == 0) & (y == 1)))
+
+    rows = tp + fp + tn + fn
+    precision = tp / (tp + fp) if tp + fp else None
+    recall = tp / (tp + fn) if tp + fn else None
+    return {
+        'holdout_rows': rows,
+        'accuracy': (tp + tn) / rows if rows else None,
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision and recall else None,
+        'approval_rate': (tp + fp) / rows if rows else None,
+        'recorded_approval_rate': (tp + fn) / rows if rows else None,
+        'confusion': {'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn},
+    }
+
+
+def train_from_history(history, n_trees=DEFAULT_TREES, max_depth=DEFAULT_MAX_DEPTH, n_jobs=-1, seed=42,
+                       min_rows=DEFAULT_MIN_ROWS, log=print):
+    """Fit on history and score the holdout. Returns (model, metadata for the artifact manifest)."""
+    started = time.perf_counter()
+    model, counts = fit_forest(history, n_trees, max_depth, n_jobs, seed, min_rows, log)
+    trained = time.perf_counter()
+    metrics = evaluate_model(model, history)
+    log(f"holdout: {metrics['holdout_rows']} applications, accuracy {metrics['accuracy']}")
+
+    return model, {
+        'trained_at': datetime.utcnow().isoformat(),
+        'source': str(history),
+        'features': list(FEATURES),
+        'training_rows': counts[0] + counts[1],
+        'class_counts': {'Rejected': counts[0], 'Approved': counts[1]},
+        'params': {'n_trees': model.n_estimators, 'max_depth': max_depth, 'n_jobs': n_jobs, 'seed': seed,
+                   'chunk_size': history.chunk_size, 'holdout_modulus': HOLDOUT_MODULUS},
+        'train_seconds': round(trained - started, 3),
+        'evaluate_seconds': round(time.perf_counter() - trained, 3),
+        'metrics': metrics,
+    }
@@ -0,0 +1,66 @@
+import hashlib
+import tempfile
+
+from docverify import perceptual_hash
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 256 * 1024  # Uploads larger than this spill from memory to a temp file
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):g} MB"
+    return f"{size / 1024:g} KB"
+
+
+class UploadError(Exception):
+    """Raised for an upload that is not allowed (wrong type or too large)."""
+
+
+class Upload:
+    """An uploaded file copied into a spooled temp file, with its SHA-256 and size."""
+
+    def __init__(self, filename, file, sha256, size):
+        self.filename = filename
+        self.file = file
+        self.sha256 = sha256
+        self.size = size
+
+    def phash(self):
+        return perceptual_hash(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+def receive_upload(file, allowed, max_size, tmp_dir=None, chunk_size=CHUNK_SIZE, spool_size=SPOOL_SIZE):
+    """Stream a werkzeug FileStorage into a spooled temp file, hashing it on the way.
+
+    allowed(filename) decides whether the file type is accepted. Returns None when no
+    file was sent, otherwise an Upload rewound to the start. Raises UploadError for a
+    disallowed type or as soon as more than max_size bytes have been read.
+    """
+    if not file or not file.filename:
+        return None
+    if not allowed(file.filename):
+        raise UploadError(f"{file.filename}: file type not allowed")
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_size, dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+            size += len(chunk)
+            if size > max_size:
+                raise UploadError(f"{file.filename}: file is larger than {format_size(max_size)}")
+            digest.update(chunk)
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+
+    if not size:
+        spooled.close()
+        return None
+    spooled.seek(0)
+    return Upload(file.filename, spooled, digest.hexdigest(), size)